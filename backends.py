@@ -0,0 +1,229 @@
+#Storage backends a paste can be uploaded to. Pick one with make_backend(settings).
+import os
+import shutil
+import time
+from ftplib import all_errors, error_perm
+
+import metrics
+from ftppool import FTPPool
+
+class Backend(object):
+    #capabilities, so the upload engine can pick the fastest path for each backend
+    parallel = False #several uploads can run at the same time
+    resumable = False #an interrupted upload can continue from a byte offset
+    max_parallel = 1
+
+    def __init__(self, settings, journal=None):
+        self.settings = settings
+        self.journal = journal #uploads.UploadJournal, used by resumable backends
+
+    def configured(self):
+        #cheap check that the settings are filled in, no I/O
+        return True
+
+    def health_check(self):
+        #can we actually reach the backend right now
+        return self.configured()
+
+    def upload(self, stream, name):
+        raise NotImplementedError
+
+    def upload_file(self, path, name):
+        fp = open(path, 'rb')
+        try:
+            self.upload(fp, name)
+        finally:
+            fp.close()
+
+    def public_url(self, name):
+        raise NotImplementedError
+
+    def exists(self, name):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class FTPBackend(Backend):
+    parallel = True
+    resumable = True
+    max_parallel = 4
+    resume_min_size = 8*1024*1024 #smaller files are just sent again
+    resume_retries = 5
+    resume_margin = 4*1024*1024 #journal offsets count bytes handed to the socket, not ones the server has
+    blocksize = 64*1024
+
+    def __init__(self, settings, journal=None):
+        Backend.__init__(self, settings, journal)
+        self.pool = FTPPool(settings['ftp_host'], settings['ftp_username'], settings['ftp_password'], size=self.max_parallel)
+
+    def configured(self):
+        s = self.settings
+        return '' not in (s['ftp_host'], s['ftp_public_url'], s['ftp_username'], s['ftp_password'])
+
+    def health_check(self):
+        if not self.configured():
+            return False
+        try:
+            self.pool.release(self.pool.acquire())
+            return True
+        except Exception:
+            return False
+
+    def upload(self, stream, name):
+        self.pool.storbinary('STOR '+self.settings['ftp_remote_dir']+name, stream, callback=metrics.transferred)
+
+    def upload_file(self, path, name):
+        size = os.path.getsize(path)
+        if self.journal is None or size < self.resume_min_size:
+            return Backend.upload_file(self, path, name)
+        #big file: send it in a way that survives dropped connections. Once some of it has been
+        #sent (by this call or, for the same unchanged file, an earlier run) pick up from what the
+        #server already has (SIZE) or, on servers without SIZE, from a little before the last
+        #offset committed to the journal. Until then a remote file of that name is an older paste,
+        #not a part of this one, so a fresh upload always starts from 0.
+        self.journal.begin(name, path)
+        for attempt in range(self.resume_retries + 1):
+            try:
+                offset, exact = 0, True
+                if self.journal.offset(name) > 0:
+                    try:
+                        offset = self._remote_size(name) or 0
+                    except error_perm:
+                        offset = max(0, self.journal.offset(name) - self.resume_margin)
+                        exact = False
+                if offset > size:
+                    offset = 0 #remote file isn't ours, start over
+                if offset < size:
+                    self._send_from(path, name, offset, exact)
+                break
+            except all_errors:
+                if attempt == self.resume_retries:
+                    raise
+                time.sleep(min(2 ** attempt, 30))
+        self.journal.finish(name)
+
+    def _send_from(self, path, name, offset, exact=True):
+        #exact: offset is the remote file's size, so appending to it is safe
+        remote = self.settings['ftp_remote_dir']+name
+        sent = [offset]
+        def committed(block):
+            metrics.transferred(block)
+            sent[0] += len(block)
+            self.journal.commit(name, sent[0])
+        fp = open(path, 'rb')
+        ftp_conn = self.pool.acquire()
+        try:
+            fp.seek(offset)
+            ftp_conn.voidcmd('TYPE I')
+            with metrics.phase('transfer'):
+                if offset == 0:
+                    ftp_conn.storbinary('STOR '+remote, fp, self.blocksize, committed)
+                else:
+                    try:
+                        ftp_conn.storbinary('STOR '+remote, fp, self.blocksize, committed, rest=offset)
+                    except error_perm:
+                        #server refused REST for STOR, append to what's there instead, or start
+                        #over if we don't know exactly where what's there ends
+                        if not exact:
+                            offset = sent[0] = 0
+                        fp.seek(offset)
+                        ftp_conn.storbinary(('APPE ' if offset else 'STOR ')+remote, fp, self.blocksize, committed)
+        except all_errors:
+            self.pool.release(ftp_conn, broken=True)
+            raise
+        finally:
+            fp.close()
+            self.journal.commit(name, sent[0], force=True)
+        self.pool.release(ftp_conn)
+
+    def _remote_size(self, name):
+        #size of the remote file, None if it doesn't exist; error_perm if the server has no SIZE
+        ftp_conn = self.pool.acquire()
+        try:
+            ftp_conn.voidcmd('TYPE I') #SIZE is only reliable in binary mode
+            size = ftp_conn.size(self.settings['ftp_remote_dir']+name)
+        except error_perm as e:
+            self.pool.release(ftp_conn)
+            if str(e).startswith('550'):
+                return None
+            raise
+        except all_errors:
+            self.pool.release(ftp_conn, broken=True)
+            raise
+        self.pool.release(ftp_conn)
+        return size
+
+    def public_url(self, name):
+        return self.settings['ftp_public_url']+name
+
+    def exists(self, name):
+        try:
+            return self._remote_size(name) is not None
+        except error_perm:
+            return False
+
+    def close(self):
+        self.pool.close()
+
+class DirectoryBackend(Backend):
+    #copies pastes into a local folder that is served (or synced) somewhere else
+    parallel = True
+    max_parallel = 4
+
+    def directory(self):
+        raise NotImplementedError
+
+    def _target(self, name):
+        folder = self.directory()
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        return os.path.join(folder, name)
+
+    def upload(self, stream, name):
+        datafo = open(self._target(name), 'wb')
+        try:
+            with metrics.phase('transfer'):
+                shutil.copyfileobj(stream, datafo)
+            metrics.sent(datafo.tell())
+        finally:
+            datafo.close()
+
+    def upload_file(self, path, name):
+        with metrics.phase('transfer'):
+            shutil.copyfile(path, self._target(name))
+        metrics.sent(os.path.getsize(path))
+
+    def exists(self, name):
+        return os.path.isfile(os.path.join(self.directory(), name))
+
+class DropboxBackend(DirectoryBackend):
+    def configured(self):
+        s = self.settings
+        return s['db_public_path'] != '' and s['db_public_url'] != '' and os.path.isdir(s['db_public_path'])
+
+    def directory(self):
+        return self.settings['db_public_path'] + '.clipbox/'
+
+    def public_url(self, name):
+        return 'http://dl.dropbox.com/u/'+self.settings['db_public_url']+'/' + '.clipbox/'+name
+
+class LocalBackend(DirectoryBackend):
+    #plain directory + base URL, handy for tests and for a locally served web root
+    def configured(self):
+        return self.settings.get('local_path', '') != ''
+
+    def directory(self):
+        return self.settings['local_path']
+
+    def public_url(self, name):
+        return (self.settings.get('local_public_url') or 'file://'+os.path.abspath(self.settings['local_path'])+'/')+name
+
+backends = {
+    'ftp': FTPBackend,
+    'dropbox': DropboxBackend,
+    'local': LocalBackend,
+}
+
+def make_backend(settings, journal=None):
+    return backends.get(settings['backend'], DropboxBackend)(settings, journal)
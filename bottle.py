@@ -35,7 +35,7 @@ if __name__ == '__main__':
     if _cmd_options.server and _cmd_options.server.startswith('gevent'):
         import gevent.monkey; gevent.monkey.patch_all()
 
-import base64, cgi, email.utils, functools, hmac, imp, itertools, mimetypes,\
+import base64, cgi, email.utils, functools, hashlib, hmac, imp, itertools, mimetypes,\
         os, re, subprocess, sys, tempfile, threading, time, urllib, warnings
 
 from datetime import date as datedate, datetime, timedelta
@@ -2119,6 +2119,138 @@ def static_file(filename, root, mimetype='auto', download=False):
     return HTTPResponse(body, **headers)
 
 
+class StaticFiles(object):
+    """ A cached :func:`static_file` for everything below one root directory.
+
+        The checks, stat and mimetype lookup are done once per file and
+        repeated at most every `check_interval` seconds to notice changes.
+        Files up to `max_size` bytes are kept in memory, together with gzip
+        and (if the brotli module is installed) br variants of the
+        compressible ones, negotiated by Accept-Encoding. Every variant has
+        a strong ETag and If-None-Match / If-Modified-Since are answered
+        with 304. Range requests and bigger files go to :func:`static_file`.
+
+        Usage: ``assets = StaticFiles('./static/')``, then
+        ``return assets(filename)`` from a route.
+    """
+    compressible = ('text/', 'application/javascript', 'application/x-javascript',
+                    'application/json', 'application/xml', 'image/svg+xml',
+                    'application/vnd.ms-fontobject', 'font/ttf', 'application/x-font-ttf',
+                    'image/x-icon', 'image/vnd.microsoft.icon')
+
+    def __init__(self, root, max_size=1024*1024, check_interval=2, compresslevel=9):
+        self.root = os.path.abspath(root) + os.sep
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self.compresslevel = compresslevel
+        self.cache = {}
+        try: import brotli
+        except ImportError: brotli = None
+        self.brotli = brotli
+
+    def _load(self, filename):
+        path = os.path.abspath(os.path.join(self.root, filename.strip('/\\')))
+        if not path.startswith(self.root):
+            return HTTPError(403, "Access denied.")
+        if not os.path.exists(path) or not os.path.isfile(path):
+            return HTTPError(404, "File does not exist.")
+        if not os.access(path, os.R_OK):
+            return HTTPError(403, "You do not have permission to access this file.")
+        stats = os.stat(path)
+        entry = {'path': path, 'mtime': stats.st_mtime, 'size': stats.st_size,
+                 'checked': time.time(), 'headers': {}, 'variants': {}}
+        mimetype, encoding = mimetypes.guess_type(path)
+        if mimetype: entry['headers']['Content-Type'] = mimetype
+        if encoding: entry['headers']['Content-Encoding'] = encoding
+        entry['headers']['Last-Modified'] = time.strftime("%a, %d %b %Y %H:%M:%S GMT",
+                                                          time.gmtime(stats.st_mtime))
+        if stats.st_size > self.max_size:
+            return entry
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        etag = hashlib.sha1(data).hexdigest()[:20]
+        entry['variants'][None] = (data, '"%s"' % etag)
+        if mimetype and not encoding and mimetype.startswith(self.compressible):
+            packed = self._gzip(data)
+            if len(packed) < len(data):
+                entry['variants']['gzip'] = (packed, '"%s-gz"' % etag)
+            if self.brotli:
+                packed = self.brotli.compress(data)
+                if len(packed) < len(data):
+                    entry['variants']['br'] = (packed, '"%s-br"' % etag)
+        return entry
+
+    def _gzip(self, data):
+        import gzip
+        buf = BytesIO()
+        gz = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=self.compresslevel, mtime=0)
+        gz.write(data)
+        gz.close()
+        return buf.getvalue()
+
+    def entry(self, filename):
+        ''' Cached metadata of a file, or an :exc:`HTTPError`. '''
+        entry = self.cache.get(filename)
+        if entry is not None and time.time() - entry['checked'] > self.check_interval:
+            try:
+                stats = os.stat(entry['path'])
+                if (stats.st_mtime, stats.st_size) == (entry['mtime'], entry['size']):
+                    entry['checked'] = time.time()
+                else:
+                    entry = None
+            except OSError:
+                entry = None
+        if entry is None:
+            self.cache.pop(filename, None)
+            entry = self._load(filename)
+            if isinstance(entry, HTTPError):
+                return entry
+            self.cache[filename] = entry
+        return entry
+
+    def _encoding(self, variants):
+        accepted = {}
+        for part in request.environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+            coding, _, params = part.strip().partition(';')
+            q = 1.0
+            if params.strip().startswith('q='):
+                try: q = float(params.strip()[2:])
+                except ValueError: q = 0.0
+            accepted[coding.strip().lower()] = q
+        for coding in ('br', 'gzip'):
+            if coding in variants and accepted.get(coding, accepted.get('*', 0)) > 0:
+                return coding
+        return None
+
+    def __call__(self, filename):
+        entry = self.entry(filename)
+        if isinstance(entry, HTTPError):
+            return entry
+        variants = entry['variants']
+        if not variants or 'HTTP_RANGE' in request.environ:
+            return static_file(filename, self.root)
+        coding = self._encoding(variants)
+        body, etag = variants[coding]
+        headers = dict(entry['headers'], ETag=etag)
+        if len(variants) > 1:
+            headers['Vary'] = 'Accept-Encoding'
+        if coding:
+            headers['Content-Encoding'] = coding
+        inm = request.environ.get('HTTP_IF_NONE_MATCH')
+        if inm is not None:
+            not_modified = etag in [tag.strip() for tag in inm.split(',')] or inm.strip() == '*'
+        else:
+            ims = request.environ.get('HTTP_IF_MODIFIED_SINCE')
+            if ims:
+                ims = parse_date(ims.split(";")[0].strip())
+            not_modified = ims is not None and ims >= int(entry['mtime'])
+        if not_modified:
+            headers['Date'] = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime())
+            return HTTPResponse(status=304, **headers)
+        headers['Content-Length'] = len(body)
+        return HTTPResponse('' if request.method == 'HEAD' else body, **headers)
+
+
 
 
 
@@ -2386,6 +2518,104 @@ class WSGIRefServer(ServerAdapter):
         srv.serve_forever()
 
 
+class ThreadPoolServer(ServerAdapter):
+    """ Standard library only, like WSGIRefServer, but requests are served by
+        a fixed pool of worker threads and HTTP/1.1 connections are kept
+        alive, so one slow client doesn't stall everybody else.
+
+        Options: ``workers`` (default 16), ``keepalive`` (seconds an idle
+        connection is kept open, default 5) and ``backlog`` (listen queue,
+        default 64). A connection is closed instead of kept alive while other
+        connections are waiting for a worker, after a request with a body and
+        after a response without a Content-Length. """
+    def run(self, handler): # pragma: no cover
+        import socket
+        from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, ServerHandler
+        try: from queue import Queue
+        except ImportError: from Queue import Queue
+        workers = int(self.options.pop('workers', 16))
+        keepalive = float(self.options.pop('keepalive', 5))
+        backlog = int(self.options.pop('backlog', 64))
+        quiet = self.quiet
+        pending = Queue()
+
+        class KeepAliveHandler(ServerHandler):
+            http_version = '1.1'
+            def cleanup_headers(self):
+                ServerHandler.cleanup_headers(self)
+                conn = self.request_handler
+                if 'Content-Length' not in self.headers:
+                    conn.close_connection = 1
+                if conn.close_connection or not pending.empty():
+                    conn.close_connection = 1
+                    self.headers['Connection'] = 'close'
+                elif conn.request_version == 'HTTP/1.0':
+                    self.headers['Connection'] = 'keep-alive'
+
+        class RequestHandler(WSGIRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            timeout = keepalive
+            wbufsize = -1 # Buffered, flushed once per response
+            def setup(self):
+                WSGIRequestHandler.setup(self)
+                # Headers and body are separate writes, don't let Nagle and
+                # delayed ACKs hold the second one back on a reused connection
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            def handle(self):
+                self.close_connection = 1
+                self.handle_one_request()
+                while not self.close_connection:
+                    self.handle_one_request()
+            def handle_one_request(self):
+                try:
+                    self.raw_requestline = self.rfile.readline(65537)
+                except socket.timeout:
+                    self.close_connection = 1
+                    return
+                if not self.raw_requestline:
+                    self.close_connection = 1
+                    return
+                if len(self.raw_requestline) > 65536:
+                    self.requestline = self.request_version = self.command = ''
+                    self.send_error(414)
+                    self.close_connection = 1
+                    return
+                if not self.parse_request():
+                    return
+                if self.headers.get('Content-Length', '0') != '0' or \
+                   self.headers.get('Transfer-Encoding'):
+                    self.close_connection = 1 # The app may not read the whole body
+                wsgi = KeepAliveHandler(self.rfile, self.wfile, self.get_stderr(),
+                                        self.get_environ(), multithread=True)
+                wsgi.request_handler = self
+                wsgi.run(self.server.get_app())
+                self.wfile.flush()
+            if quiet:
+                def log_request(*args, **kw): pass
+
+        class PoolServer(WSGIServer):
+            request_queue_size = backlog
+            def process_request(self, request, client_address):
+                pending.put((request, client_address))
+            def work(self):
+                while True:
+                    request, client_address = pending.get()
+                    try:
+                        self.finish_request(request, client_address)
+                    except Exception:
+                        self.handle_error(request, client_address)
+                    finally:
+                        self.shutdown_request(request)
+
+        srv = PoolServer((self.host, self.port), RequestHandler)
+        srv.set_app(handler)
+        for i in range(workers):
+            worker = threading.Thread(target=srv.work)
+            worker.daemon = True
+            worker.start()
+        srv.serve_forever()
+
+
 class CherryPyServer(ServerAdapter):
     def run(self, handler): # pragma: no cover
         from cherrypy import wsgiserver
@@ -2561,6 +2791,7 @@ server_names = {
     'cgi': CGIServer,
     'flup': FlupFCGIServer,
     'wsgiref': WSGIRefServer,
+    'threadpool': ThreadPoolServer,
     'waitress': WaitressServer,
     'cherrypy': CherryPyServer,
     'paste': PasteServer,
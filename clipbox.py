@@ -1,7 +1,12 @@
+import codecs
 import json
 import wx
 import random
+import string
 import os
+import io
+import tempfile
+import shutil
 import time
 
 # For the Notifications
@@ -9,15 +14,20 @@ from Foundation import NSUserNotification, NSObject, NSDictionary
 from Foundation import NSUserNotificationCenter
 
 import webbrowser #to open http links in user's preferred browser
-import shutil #to copy files to the sent directory
 
 #for the settings webserver UI (Yeah. I'd go this far just to avoid having to make a native GUI.)
-from bottle import route, run, static_file, request
+from bottle import route, run, static_file, request, response, HTTPResponse, StaticFiles
 import thread
 
-from ftplib import FTP
+from backends import make_backend, backends
+from uploads import Paste, UploadQueue, UploadJournal, upload_files, file_index_page
+from pasteindex import PasteIndex, file_digest, data_digest
+import metrics
+from settingsstore import SettingsStore
+import screencast
+from screencast import ScreencastSession, default_screenshotter
 
-settings = {
+default_settings = {
     "backend": "ftp",
     "ftp_host": "", #ftp backend
     "ftp_public_url": "", #ftp backend
@@ -26,31 +36,193 @@ settings = {
     "ftp_remote_dir": "", #ftp backend
     "db_public_path": "", #dropbox backend
     "db_public_url": "", #dropbox backend
+    "local_path": "", #local backend
+    "local_public_url": "", #local backend, defaults to a file:// URL of local_path
     "key_first_mod": "MOD_CMD",
     "key_second_mod": "MOD_SHIFT",
     "key_copy": "C",
     "key_screenshot": "X",
     "key_screencast": "G",
+    "optimistic_urls": True, #put the URL on the clipboard before the upload finishes
+    "upload_retries": 3,
+    "text_encoding": "utf-8", #encoding for text pastes
+    "png_compression": 6, #0 (fast, big) to 9 (slow, small) for bitmap pastes
+    "multi_file_index": "page", #"page" uploads an HTML listing, "list" copies one URL per line
+    "dedup": True, #reuse the URL of an identical earlier paste instead of uploading again
+    "dedup_max_entries": 1000,
+    "dedup_verify_days": 7, #re-check that the remote file still exists after this long
+    "slow_paste_seconds": 5, #pastes slower than this are flagged in /metrics.json and logged
+    "screencast_fps": 3,
+    "screencast_max_seconds": 15,
+    "screencast_scale": 1, #shrink frames N times, 2 = half width and height (each pixel the average of 2x2)
+    "screencast_region": "full", #"full" screen, "select" to drag out a rectangle first, or "motion" to crop GIFs to what moved
+    "screencast_memory_mb": 256, #unencoded frames beyond this spill to a memory-mapped file
+    "screencast_dither": False, #ordered dithering for screencast GIFs, smoother gradients but bigger files
+    "screencast_format": "gif", #"gif", or "webm" / "mp4" through ffmpeg
+    "ffmpeg_path": "ffmpeg",
 }
+#hotkey modifier setting -> wx flag
+MODIFIERS = dict((name, getattr(wx, name)) for name in ("MOD_CMD", "MOD_CONTROL", "MOD_ALT", "MOD_SHIFT"))
+HOTKEY_SETTINGS = ("key_first_mod", "key_second_mod", "key_copy", "key_screenshot", "key_screencast")
+#everything a backend is built from
+BACKEND_SETTINGS = ["backend"] + [key for key in default_settings if key.startswith(('ftp_', 'db_', 'local_'))]
+
+#what /save accepts on top of each value having the type of its default
+settings_choices = {
+    "backend": tuple(sorted(backends)),
+    "key_first_mod": tuple(sorted(MODIFIERS)),
+    "key_second_mod": tuple(sorted(MODIFIERS)),
+    "key_copy": tuple(string.ascii_uppercase + string.digits),
+    "key_screenshot": tuple(string.ascii_uppercase + string.digits),
+    "key_screencast": tuple(string.ascii_uppercase + string.digits),
+    "multi_file_index": ("page", "list"),
+    "screencast_region": ("full", "select", "motion"),
+    "screencast_format": ("gif", "webm", "mp4"),
+}
+settings_ranges = {
+    "upload_retries": (0, 10),
+    "png_compression": (0, 9),
+    "dedup_max_entries": (1, 1000000),
+    "dedup_verify_days": (0, 3650),
+    "slow_paste_seconds": (0, 3600),
+    "screencast_fps": (1, 30),
+    "screencast_max_seconds": (1, 600),
+    "screencast_scale": (1, 16),
+    "screencast_memory_mb": (16, 65536),
+}
+def check_encoding(name):
+    try:
+        codecs.lookup(name)
+    except LookupError:
+        raise ValueError('must be a known encoding, like utf-8')
 
-def load_settings():
+settings_validators = {
+    "text_encoding": check_encoding,
+}
+settings_store = SettingsStore('config.txt', default_settings, settings_choices, settings_ranges, settings_validators)
+settings = settings_store.settings
+
+backend = None
+upload_journal = UploadJournal('upload_journal.json')
+paste_metrics = metrics.MetricsStore(slow_seconds=float(settings['slow_paste_seconds']))
+
+def get_backend():
+    #the backend for the current settings, see reload_backend
+    global backend
+    if backend is None:
+        backend = make_backend(settings, upload_journal)
+    return backend
+
+def reload_backend(new_settings):
+    #Backend settings were saved: close the old connections and connect with the new credentials
+    #now, so the next paste doesn't wait for it. health_check connects, and fills the FTP pool.
+    global backend
+    old, backend = backend, make_backend(new_settings, upload_journal)
+    if old is not None:
+        old.close()
+    if backend.configured():
+        thread.start_new_thread(backend.health_check, ())
+
+paste_index = None
+
+def get_paste_index():
+    global paste_index
+    if paste_index is None:
+        paste_index = PasteIndex('paste_index.json', int(settings['dedup_max_entries']), float(settings['dedup_verify_days'])*24*3600)
+    return paste_index
+
+def set_slow_seconds(new_settings):
+    paste_metrics.slow_seconds = float(new_settings['slow_paste_seconds'])
+
+def resize_paste_index(new_settings):
+    if paste_index is not None:
+        paste_index.max_entries = int(new_settings['dedup_max_entries'])
+        paste_index.verify_after = float(new_settings['dedup_verify_days'])*24*3600
+
+def paste_digest(paste):
+    #sha256 of the paste content, None for multi-file and streamed pastes which always upload
+    if paste.kind in ('text', 'png'):
+        return data_digest(paste.data)
+    if paste.kind == 'bitmap':
+        image = paste.data
+        return data_digest(str(image.GetWidth()), 'x', str(image.GetHeight()), image.GetData(), image.GetAlphaData() if image.HasAlpha() else '')
+    if paste.kind == 'file' and len(paste.data) == 1:
+        return file_digest(paste.data[0])
+    return None
+
+PREHASH_MAX_BYTES = 1024*1024 #bigger pastes aren't hashed on the wx thread, see queuePaste
+
+def paste_size(paste):
+    #rough size in bytes of an in-memory paste, without encoding or copying it
+    if paste.kind == 'bitmap':
+        return paste.data.GetWidth() * paste.data.GetHeight() * (4 if paste.data.HasAlpha() else 3)
+    return len(paste.data)
+
+def encode_text(paste):
+    #text pastes are uploaded (and hashed) in text_encoding
+    if paste.kind == 'text' and isinstance(paste.data, unicode):
+        with paste.timer.phase('encode'):
+            paste.data = paste.data.encode(settings['text_encoding'], 'replace')
+
+def paste_url(backend, paste):
+    #what goes on the clipboard; a multi-file paste is either an index page or one URL per line
+    if paste.kind == 'file' and len(paste.data) > 1 and settings['multi_file_index'] == 'list':
+        return '\n'.join(backend.public_url(os.path.basename(path)) for path in paste.data)
+    return backend.public_url(paste.name)
+
+def new_paste_id():
+    return time.strftime("%Y-%m-%d_%H-%M-%S", time.gmtime())+''.join(random.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789') for x in range(6))
+
+def encode_png(image):
+    #encode a wx.Image straight into memory, png_compression trades encode CPU for upload bytes
+    with metrics.phase('encode'):
+        image.SetOptionInt(wx.IMAGE_OPTION_PNG_COMPRESSION_LEVEL, int(settings['png_compression']))
+        buf = io.BytesIO()
+        image.SaveStream(buf, wx.BITMAP_TYPE_PNG)
+        data = buf.getvalue()
+    metrics.note('encoded_bytes', len(data))
+    return data
+
+def purge_temp_dir():
+    #bitmap pastes used to be saved to temp/ and never deleted, screencasts to screencast_images/
+    if os.path.isdir('temp'):
+        for name in os.listdir('temp'):
+            if os.path.isfile('temp/'+name):
+                os.remove('temp/'+name)
+    shutil.rmtree('screencast_images', ignore_errors=True)
+    #working directories of screencast sessions that never finished
+    for name in os.listdir(tempfile.gettempdir()):
+        if name.startswith('clipbox-screencast-'):
+            shutil.rmtree(os.path.join(tempfile.gettempdir(), name), ignore_errors=True)
+
+def use_settings(new_settings):
+    #settings_store hands over a new read-only snapshot on every change, rebinding the global is atomic
     global settings
-    try:
-        spdatafile = open('config.txt', 'r')
-        jsoncode = spdatafile.read()
-        spdatafile.close()
-        settings = json.loads(jsoncode)
-    except:
-        pass
+    settings = new_settings
+
+def load_settings():
+    settings_store.reload()
+    use_settings(settings_store.settings)
+
+settings_store.subscribe(use_settings)
+settings_store.subscribe(reload_backend, BACKEND_SETTINGS)
+settings_store.subscribe(resize_paste_index, ("dedup_max_entries", "dedup_verify_days"))
+settings_store.subscribe(set_slow_seconds, ("slow_paste_seconds",))
 
 class mainFrame(wx.Frame):
     global settings
     def __init__(self, parent, id, title):
         style = wx.DEFAULT_FRAME_STYLE ^ wx.RESIZE_BORDER
         self.window = wx.Frame.__init__(self, parent, id, title, size=(450,555), style=style)
-        self.screencastInProgress = False
+        self.screencasts = [] #ScreencastSessions not done yet
+        self.regionPicker = None
+        self.uploads = UploadQueue(self.uploadPaste,
+            lambda paste, url: wx.CallAfter(self.onUploadDone, paste, url),
+            lambda paste, error: wx.CallAfter(self.onUploadFailed, paste, error))
 
+        self.hotkeysRegistered = False
         self.regHotKey()
+        settings_store.subscribe(lambda new_settings: wx.CallAfter(self.regHotKey), HOTKEY_SETTINGS)
         self.Bind(wx.EVT_HOTKEY, self.handleHotKey, id=self.hotCopy)
         self.Bind(wx.EVT_HOTKEY, self.handleHotKey, id=self.hotScreenRect)
         self.Bind(wx.EVT_HOTKEY, self.handleHotKey, id=self.hotScreenCast)
@@ -70,21 +242,12 @@ class mainFrame(wx.Frame):
         self.Layout()
         
     def checkSettings(self):
-        global settings
-        pop_settings_ui = False
-        if settings['backend'] == "ftp":
-            if settings['ftp_host'] == '' or settings['ftp_public_url'] == '' or settings['ftp_username'] == '' or settings['ftp_password'] == '':
-                pop_settings_ui = True
-        else:
-            if settings['db_public_path'] == '' or settings['db_public_url'] == '':
-                    pop_settings_ui = True
-            else:
-                if not os.path.isdir(settings['db_public_path']):
-                    pop_settings_ui = True
-        if pop_settings_ui:
+        if not get_backend().configured():
             webbrowser.open("http://localhost:8181/")
 
     def onFullClose(self, event):
+        if backend is not None:
+            backend.close()
         for w in wx.GetTopLevelWindows():
             w.Destroy()
         self.Destroy()
@@ -92,93 +255,173 @@ class mainFrame(wx.Frame):
     def StartServer(self): 
         thread.start_new_thread(self._StartServe, ())
         self.checkSettings()
+        self.resumeUploads()
+
+    def resumeUploads(self):
+        #big uploads that were cut off when the app last quit carry on from their journal offset
+        backend = get_backend()
+        for name, path in upload_journal.pending():
+            if not backend.resumable: #journaled for a backend that is no longer in use
+                upload_journal.finish(name)
+                continue
+            paste = Paste('file', name, [path])
+            paste.url = backend.public_url(name) #already handed out, don't touch the clipboard
+            self.uploads.put(paste)
         
     def _StartServe(self):
         print "starting server thread..." 
 
         @route('/settings.js', method='GET')
         def settingsjs():
-            spdatafile = open('config.txt', 'r')
-            settings_data = spdatafile.read()
-            spdatafile.close()
-            return "load_current_settings("+json.dumps(settings_data)+");"
+            #served from memory, settings_store rebuilds it when config.txt changes
+            script, etag = settings_store.script()
+            if request.environ.get('HTTP_IF_NONE_MATCH') == etag:
+                return HTTPResponse(status=304, ETag=etag)
+            response.set_header('Content-Type', 'application/javascript')
+            response.set_header('ETag', etag)
+            return script
 
         @route('/save', method='POST')
         def save():
-            data = request.forms.get('data')
-            spdatafile = open('config.txt', 'w')
-            spdatafile.write(data)
-            spdatafile.close()
-            load_settings()
+            errors = settings_store.write(request.forms.get('data'))
+            if errors:
+                return json.dumps({"status":"error", "errors":errors})
             return json.dumps({"status":"success"})
+
+        @route('/metrics.json', method='GET')
+        def metricsjson():
+            #?slow=1 for just the pastes that took longer than slow_paste_seconds
+            return json.dumps({
+                "summary": paste_metrics.summary(),
+                "pastes": paste_metrics.recent(slow_only=request.query.get('slow') == '1'),
+            })
         
         @route('/')
         def base():
             return static_file("index.html", root='./')
         
+        assets = StaticFiles('./static/') #stat'ed once, kept in memory and gzipped
         @route('/static/:filename#.*#')
         def send_static(filename):
-            return static_file(filename, root='./static/')
+            return assets(filename)
 
-        run(host='0.0.0.0', port=8181)
+        run(server='threadpool', host='0.0.0.0', port=8181) #a thread pool, so a slow or idle keep-alive browser connection can't hold up /save
 
     def OnClose(self,event):
         self.Show(False)
         event.Veto()
 
+    #a unique ID for each hotkey
+    hotCopy = 100
+    hotScreenRect = 104
+    hotScreenCast = 107
+
     def regHotKey(self):
+        #(re)register the hotkeys from the current settings, runs again whenever they are saved
         global settings
-
-        self.hotCopy = 100
-        self.RegisterHotKey(
-            self.hotCopy,
-            eval("wx."+settings['key_first_mod']) | eval("wx."+settings['key_second_mod']),
-            ord(settings['key_copy']))
-
-        self.hotScreenRect = 104
-        self.RegisterHotKey(
-            self.hotScreenRect, #a unique ID for this hotkey
-            eval("wx."+settings['key_first_mod']) | eval("wx."+settings['key_second_mod']),
-            ord(settings['key_screenshot']))
-
-        self.hotScreenCast = 107
-        self.RegisterHotKey(
-            self.hotScreenCast, #a unique ID for this hotkey
-            eval("wx."+settings['key_first_mod']) | eval("wx."+settings['key_second_mod']),
-            ord("G"))
+        modifiers = MODIFIERS[settings['key_first_mod']] | MODIFIERS[settings['key_second_mod']]
+        for hotkey, key in ((self.hotCopy, 'key_copy'), (self.hotScreenRect, 'key_screenshot'), (self.hotScreenCast, 'key_screencast')):
+            if self.hotkeysRegistered:
+                self.UnregisterHotKey(hotkey)
+            if not self.RegisterHotKey(hotkey, modifiers, ord(settings[key])):
+                notify('Could not register the %s shortcut, is another application using it?' % key[4:])
+        self.hotkeysRegistered = True
 
     def handleHotKey(self, evt):
+        #runs on the wx event thread, so nothing in here may block; uploads happen in self.uploads
         eventId = evt.GetId()
         if eventId == self.hotScreenRect: 
-            os.system('screencapture -c -i') #allow user to draw rectangle screenshot, copy image to clipboard
-            self.onHotCopy()
+            thread.start_new_thread(self._captureScreenRect, ())
         elif eventId == self.hotCopy:
-            time.sleep(1)
-            os.system("""osascript -e 'tell application "System Events" to keystroke "c" using {command down}'""") #send copy command.
-            time.sleep(1.5)
-            self.onHotCopy()
+            thread.start_new_thread(self._sendCopyKeystroke, ())
         elif eventId == self.hotScreenCast:
-            if not self.screencastInProgress:
-                self.screencastInProgress = True
-                time.sleep(1)
-                os.system('rm -rf screencast_images')
-                os.system('mkdir screencast_images')
-                notify('Screencast started, hit cmd+shift+g again to end, or wait 15 seconds.')
-                thread.start_new_thread(self._startScreencast, ())
-            else:
-                self.screencastInProgress = False
-
-    def _startScreencast(self):
-        for i in range(1000, 1045):
-            time.sleep(0.33)
-            os.system('screencapture -r -x -m ./screencast_images/'+str(i)+".png")
-            if not self.screencastInProgress:
-                break #If they hit shortcut key again, break early
-        pasteID = time.strftime("%Y-%m-%d_%H-%M-%S", time.gmtime())+''.join(random.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789') for x in range(6))
-        notify('Generating gif...')
-        os.system("./convert -delay 20 -loop 0 screencast_images/*png screencast_images/"+pasteID+".gif")
-        self.onHotCopy(override_file="screencast_images/"+pasteID+".gif")
-
+            #earlier screencasts may still be encoding or uploading, a new one can start regardless
+            recording = self.recordingScreencast()
+            if recording is not None:
+                recording.stop() #If they hit shortcut key again, stop early
+            elif self.regionPicker is None:
+                if settings['screencast_region'] == 'select':
+                    self.regionPicker = RegionPicker(self.onRegionPicked)
+                else:
+                    self.startScreencast()
+
+    def _captureScreenRect(self):
+        #allow user to draw rectangle screenshot; the PNG goes straight to the upload queue, not via the clipboard
+        shotter = default_screenshotter(int(settings['png_compression']))
+        try:
+            data = shotter.shoot()
+        finally:
+            shotter.close()
+        if data is None:
+            return
+        paste = Paste('png', new_paste_id()+".png", data)
+        paste.timer.info['encoded_bytes'] = len(data)
+        wx.CallAfter(self.queuePaste, paste)
+
+    def _sendCopyKeystroke(self):
+        #on a thread of its own, osascript takes long enough to stall the UI
+        time.sleep(1) #let the hotkey's modifiers go first
+        os.system("""osascript -e 'tell application "System Events" to keystroke "c" using {command down}'""") #send copy command.
+        time.sleep(1.5) #give the app time to fill the clipboard
+        wx.CallAfter(self.onHotCopy)
+
+    def recordingScreencast(self):
+        for session in self.screencasts:
+            if session.state in (None, screencast.RECORDING):
+                return session
+        return None
+
+    def onRegionPicked(self, region):
+        self.regionPicker = None
+        if region is not None: #None if the picker was cancelled
+            self.startScreencast(region)
+
+    def startScreencast(self, region=None):
+        fmt = settings['screencast_format']
+        session = ScreencastSession(new_paste_id(), lambda session, state: wx.CallAfter(self.onScreencastChange, session, state),
+                                    fps=float(settings['screencast_fps']),
+                                    max_seconds=float(settings['screencast_max_seconds']),
+                                    scale=int(settings['screencast_scale']),
+                                    region=region,
+                                    format=fmt,
+                                    memory_limit=int(float(settings['screencast_memory_mb']) * 1024 * 1024),
+                                    dither=settings['screencast_dither'],
+                                    crop_to_motion=settings['screencast_region'] == 'motion',
+                                    ffmpeg=settings['ffmpeg_path'])
+        self.screencasts.append(session)
+        session.start()
+
+    def cancelScreencasts(self):
+        for session in list(self.screencasts):
+            session.cancel()
+
+    def onScreencastChange(self, session, state):
+        #runs on the wx thread for every state a ScreencastSession goes through
+        if state == screencast.RECORDING:
+            if session.video():
+                #upload the video while ffmpeg is still writing it
+                paste = Paste('stream', session.filename, session.stream)
+                paste.session = session
+                self.queuePaste(paste)
+            notify('Screencast started, hit the shortcut again to end, or wait %d seconds.' % session.max_seconds)
+        elif state == screencast.ENCODING:
+            if not session.video():
+                notify('Finishing gif...')
+        elif state == screencast.UPLOADING:
+            if not session.video():
+                paste = Paste('file', session.filename, [session.path])
+                paste.session = session
+                self.queuePaste(paste)
+        else:
+            if session in self.screencasts:
+                self.screencasts.remove(session)
+            if state == screencast.CANCELLED:
+                notify('Screencast cancelled.')
+            elif state == screencast.FAILED and session.error is not None:
+                if session.video() and isinstance(session.error, OSError):
+                    notify('Screencast failed, is ffmpeg installed? (%s)' % session.error)
+                else:
+                    notify('Screencast failed: %s' % session.error)
 
     def copyToClipboard(self, text):
         td = wx.TextDataObject()
@@ -188,9 +431,12 @@ class mainFrame(wx.Frame):
             wx.TheClipboard.Close()
             return True
         return False
-            
-    def onHotCopy(self, override_file=None):
-        global settings
+
+    def onHotCopy(self):
+        #grab whatever is on the clipboard and queue it; the upload itself runs in uploadPaste
+        self.Show(False)
+        started = time.time()
+        paste = None
         if wx.TheClipboard.Open():
             td = wx.TextDataObject()
             fd = wx.FileDataObject()
@@ -199,76 +445,195 @@ class mainFrame(wx.Frame):
             successf = wx.TheClipboard.GetData(fd)
             successb = wx.TheClipboard.GetData(bd)
             wx.TheClipboard.Close()
-            text = td.GetText()
-            bimg = bd.GetBitmap() #this is a wx.Bitmap
-            pasteText = text
-
-        self.Show(False)
-        if settings['backend'] == "dropbox":
-            #if clipbox dropbox folder doesn't exist, create it
-            if not os.path.exists(settings['db_public_path'] + '.clipbox/'):
-                os.makedirs(settings['db_public_path'] + '.clipbox/')
-
-        if successf or override_file:
-            if override_file:
-                allFileNames = [override_file]
-            else:
+            if successf:
                 allFileNames = fd.GetFilenames()
-            pasteID =  os.path.basename(allFileNames[0])
-            try:
-                if settings['backend'] == "ftp":
-                    ftp_conn = FTP(settings['ftp_host'], settings['ftp_username'], settings['ftp_password'])
-                    ftp_conn.storbinary('STOR '+settings['ftp_remote_dir']+pasteID, open(allFileNames[0], 'rb'))
-                    public_paste_url = settings['ftp_public_url']+pasteID
+                if len(allFileNames) == 1:
+                    paste = Paste('file', os.path.basename(allFileNames[0]), allFileNames)
                 else:
-                    shutil.copyfile(allFileNames[0], settings['db_public_path']+'.clipbox/'+pasteID)
-                    public_paste_url = 'http://dl.dropbox.com/u/'+settings['db_public_url']+'/' + '.clipbox/'+pasteID
-    
+                    paste = Paste('file', new_paste_id()+".html", allFileNames) #named after the index page
+            elif successt:
+                paste = Paste('text', new_paste_id(), td.GetText())
+            elif successb:
+                #wx.Bitmap has to stay on this thread, the wx.Image is encoded to PNG by the upload worker
+                paste = Paste('bitmap', new_paste_id()+".png", bd.GetBitmap().ConvertToImage())
+        if paste is None:
+            return
+        paste.timer.started = started
+        paste.timer.add('clipboard', time.time() - started)
+        self.queuePaste(paste)
+
+    def queuePaste(self, paste):
+        if (settings['dedup'] and settings['optimistic_urls'] and paste.kind in ('text', 'png', 'bitmap')
+                and paste_size(paste) <= PREHASH_MAX_BYTES):
+            #Look for an earlier copy before publishing a URL, so a dedup hit gets the old URL up
+            #front instead of a new name that is never uploaded. Only small in-memory pastes are
+            #hashed here on the wx thread; files and big pastes are hashed on the upload worker,
+            #which only takes a hit that matches the URL already handed out.
+            with paste.timer.phase('hash'):
+                encode_text(paste)
+                paste.digest = paste_digest(paste)
+            known = get_paste_index().peek(paste.digest, get_backend())
+            if known is not None:
+                #if the old upload turns out to be gone, it is uploaded again under its old name
+                paste.name = known[0]
+        if not self.uploads.put(paste):
+            if paste.session is not None:
+                #nobody will read the screencast's stream or upload its file, stop ffmpeg and clean up
+                paste.session.finished('upload queue full')
+            notify('Too many uploads in progress, try again in a moment.')
+        elif settings['optimistic_urls']:
+            with paste.timer.phase('publish'):
+                paste.url = paste_url(get_backend(), paste)
+                self.copyToClipboard(paste.url)
+            notify('Download URL copied to your Clipboard! Uploading...')
+
+    def uploadPaste(self, paste):
+        #runs on an upload worker thread, returns the public URL
+        metrics.use(paste.timer)
+        try:
+            return self._uploadPaste(paste)
+        finally:
+            metrics.use(None)
+
+    def _uploadPaste(self, paste):
+        backend = get_backend()
+        encode_text(paste)
+        digest = paste.digest
+        if settings['dedup']:
+            if digest is None:
+                with metrics.phase('hash'):
+                    digest = paste_digest(paste)
+            if digest is not None:
+                public_paste_url = get_paste_index().lookup(digest, backend)
+                #an optimistic URL that is already out there has to work, so only take a hit that matches it
+                if public_paste_url is not None and paste.url in (None, public_paste_url):
+                    metrics.note('dedup_hit', True)
+                    return public_paste_url #seen this exact content before, no upload needed
+
+        if paste.kind == 'file':
+            names = [os.path.basename(path) for path in paste.data]
+            upload_files(backend, paste.data, names)
+            if len(names) > 1 and settings['multi_file_index'] == 'page':
+                urls = [backend.public_url(name) for name in names]
+                backend.upload(io.BytesIO(file_index_page(names, urls).encode('utf-8')), paste.name)
+        elif paste.kind == 'stream':
+            backend.upload(paste.data, paste.name)
+            if paste.session is not None:
+                error = paste.session.encoded()
+                if error is not None:
+                    raise IOError('screencast encoding failed: %s' % error)
+        elif paste.kind == 'png':
+            backend.upload(io.BytesIO(paste.data), paste.name)
+        elif paste.kind == 'text':
+            backend.upload(io.BytesIO(paste.data), paste.name)
+        else:
+            backend.upload(io.BytesIO(encode_png(paste.data)), paste.name)
+        public_paste_url = paste_url(backend, paste)
+        if digest is not None:
+            get_paste_index().add(digest, backend, paste.name, public_paste_url)
+        return public_paste_url
+
+    def onUploadDone(self, paste, public_paste_url):
+        if paste.session is not None:
+            cancelled = paste.session.state == screencast.CANCELLED
+            paste.session.finished()
+            if cancelled: #only part of the video made it up, don't hand out its URL
+                paste_metrics.add(paste.timer.record(error='cancelled', attempts=paste.attempts + 1))
+                return
+        if paste.url == public_paste_url:
+            notify('Upload finished.') #URL is already on the clipboard
+        else:
+            with paste.timer.phase('publish'):
+                paste.url = public_paste_url
                 self.copyToClipboard(public_paste_url)
-                notify('Download URL copied to your Clipboard!')
-            except:
-                notify('An Error Occurred.')
-        elif successt:
-            
-            pasteID = time.strftime("%Y-%m-%d_%H-%M-%S", time.gmtime())+''.join(random.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789') for x in range(6))
-            try:
-                if settings['backend'] == "ftp":
-                    tmpf = open("tmptxt", 'w')
-                    tmpf.write(pasteText)
-                    tmpf.close()
-                    public_paste_url = settings['ftp_public_url']+pasteID
-                    self.copyToClipboard(public_paste_url)
-                    ftp_conn = FTP(settings['ftp_host'], settings['ftp_username'], settings['ftp_password'])
-                    ftp_conn.storbinary('STOR '+settings['ftp_remote_dir']+pasteID, open("tmptxt"))
-                else:
-                    datafo = open(settings['db_public_path']+'.clipbox/'+pasteID, 'w')
-                    datafo.write(pasteText)
-                    datafo.close()
-                    public_paste_url = 'http://dl.dropbox.com/u/'+settings['db_public_url']+'/' + '.clipbox/'+pasteID
-                    self.copyToClipboard(public_paste_url)
-                notify('Download URL copied to your Clipboard!')
-            except:
-                notify('An Error Occurred.')
-        elif successb:
-            pasteID = time.strftime("%Y-%m-%d_%H-%M-%S", time.gmtime())+''.join(random.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789') for x in range(6))+".png"
-            bimg.SaveFile('temp/'+pasteID, wx.BITMAP_TYPE_PNG)
-            fullpath = os.getcwd() + "/temp/"+pasteID
-            try:
-                if settings['backend'] == "ftp":
-                    ftp_conn = FTP(settings['ftp_host'], settings['ftp_username'], settings['ftp_password'])
-                    ftp_conn.storbinary('STOR '+settings['ftp_remote_dir']+pasteID, open(fullpath, 'rb'))
-                    public_paste_url = settings['ftp_public_url']+pasteID
-                else:
-                    shutil.copyfile(fullpath, settings['db_public_path']+'.clipbox/'+pasteID)
-                    public_paste_url = 'http://dl.dropbox.com/u/'+settings['db_public_url']+'/' + '.clipbox/'+pasteID
-                td = wx.TextDataObject()
-                td.SetText(public_paste_url)
-                if wx.TheClipboard.Open():
-                    successt = wx.TheClipboard.SetData(td)
-                    wx.TheClipboard.Close()
-                notify('Download URL copied to your Clipboard!')
-            except ImportWarning:
-                notify('An Error Occurred.')
+            notify('Download URL copied to your Clipboard!')
+        paste_metrics.add(paste.timer.record(attempts=paste.attempts + 1))
+
+    def onUploadFailed(self, paste, error):
+        paste.attempts += 1
+        if paste.session is not None and paste.session.state == screencast.CANCELLED:
+            paste_metrics.add(paste.timer.record(error='cancelled', attempts=paste.attempts))
+            return
+        if paste.kind != 'stream' and paste.attempts <= int(settings['upload_retries']): #a stream can't be read twice
+            notify('Upload failed, retrying...')
+            wx.CallLater(2000 * paste.attempts, self.retryPaste, paste)
+            return
+        self.giveUp(paste, error)
+
+    def retryPaste(self, paste):
+        #the queue can fill up during the back-off, a retry that doesn't fit is a failed upload
+        if not self.uploads.put(paste):
+            self.giveUp(paste, 'upload queue full')
+
+    def giveUp(self, paste, error):
+        #record the failure and tell the user
+        paste_metrics.add(paste.timer.record(error=repr(error), attempts=paste.attempts))
+        if paste.session is not None:
+            paste.session.finished(error)
+        if paste.url:
+            notify('Upload failed, the URL on your clipboard will not work.')
+        else:
+            notify('An Error Occurred.')
+
+class RegionPicker(wx.Frame):
+    #Dimmed full screen overlay to drag out the part of the screen to record, like screencapture -i
+    #does for screenshots. Calls onPicked with (x, y, width, height) in screen points, or None if
+    #Escape was hit or nothing was dragged out.
+    def __init__(self, onPicked):
+        wx.Frame.__init__(self, None, -1, '', style=wx.STAY_ON_TOP | wx.FRAME_NO_TASKBAR | wx.NO_BORDER)
+        self.onPicked = onPicked
+        self.start = None
+        self.end = None
+        self.SetBackgroundColour(wx.BLACK)
+        self.SetTransparent(90)
+        self.SetCursor(wx.StockCursor(wx.CURSOR_CROSS))
+        self.Bind(wx.EVT_LEFT_DOWN, self.onDown)
+        self.Bind(wx.EVT_MOTION, self.onDrag)
+        self.Bind(wx.EVT_LEFT_UP, self.onUp)
+        self.Bind(wx.EVT_CHAR_HOOK, self.onKey)
+        self.Bind(wx.EVT_PAINT, self.onPaint)
+        self.ShowFullScreen(True)
+        self.Raise()
+        self.SetFocus()
+
+    def selection(self):
+        return wx.RectPP(self.start, self.end)
+
+    def onDown(self, event):
+        self.start = self.end = event.GetPosition()
+        self.CaptureMouse()
+
+    def onDrag(self, event):
+        if self.start is not None and event.Dragging():
+            self.end = event.GetPosition()
+            self.Refresh()
+
+    def onUp(self, event):
+        if self.start is None:
+            return
+        if self.HasCapture():
+            self.ReleaseMouse()
+        self.end = event.GetPosition()
+        rect = self.selection()
+        x, y = self.ClientToScreen(rect.GetTopLeft())
+        self.finish((x, y, rect.width, rect.height) if rect.width > 1 and rect.height > 1 else None)
+
+    def onKey(self, event):
+        if event.GetKeyCode() == wx.WXK_ESCAPE:
+            self.finish(None)
+        else:
+            event.Skip()
+
+    def onPaint(self, event):
+        dc = wx.PaintDC(self)
+        if self.start is not None:
+            dc.SetPen(wx.Pen(wx.WHITE, 2))
+            dc.SetBrush(wx.TRANSPARENT_BRUSH)
+            dc.DrawRectangleRect(self.selection())
+
+    def finish(self, region):
+        self.Destroy()
+        self.onPicked(region)
 
 class MyTaskBarIcon(wx.TaskBarIcon):
     def __init__(self, frame):
@@ -283,6 +648,7 @@ class MyTaskBarIcon(wx.TaskBarIcon):
         self.SetIcon(myicon, 'ClipBox')
         self.Bind(wx.EVT_MENU, self.gotoweb, id=8)
         self.Bind(wx.EVT_MENU, self.showSettings, id=14)
+        self.Bind(wx.EVT_MENU, self.cancelScreencasts, id=20)
         self.Bind(wx.EVT_MENU, self.OnTaskBarClose, id=3)
         self.Bind(wx.EVT_TASKBAR_LEFT_DOWN, self.on_left_click)
 
@@ -298,6 +664,8 @@ class MyTaskBarIcon(wx.TaskBarIcon):
     def CreatePopupMenu(self):
         tbmenu = wx.Menu()
         tbmenu.Append(14, 'Settings...')
+        if self.frame.screencasts:
+            tbmenu.Append(20, 'Cancel Screencast')
         tbmenu.Append(8, 'Go To Website')
         tbmenu.Append(3, 'Exit')
         return tbmenu
@@ -308,6 +676,9 @@ class MyTaskBarIcon(wx.TaskBarIcon):
     def showSettings(self, event):
         webbrowser.open("http://localhost:8181/")
 
+    def cancelScreencasts(self, event):
+        self.frame.cancelScreencasts()
+
 def notify(text):
 
     notification = NSUserNotification.alloc().init()
@@ -319,6 +690,8 @@ def notify(text):
 class MyApp(wx.App):
     def OnInit(self):
         load_settings()
+        settings_store.watch() #pick up edits to config.txt made while we run
+        purge_temp_dir()
         mainFrame(None, -1, 'ClipBox') #already logged in
         return True
 
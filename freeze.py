@@ -71,12 +71,10 @@ if sys.platform == 'darwin':
                 return True
         return False
 
-    os.system('mkdir dist/clipbox.app/Contents/Resources/temp/')
     os.system('mkdir dist/clipbox.app/Contents/Resources/images/')
     os.system('cp -rf images/ dist/clipbox.app/Contents/Resources/images/')
     os.system('cp -rf static/ dist/clipbox.app/Contents/Resources/static/')
     os.system('cp index.html dist/clipbox.app/Contents/Resources/index.html')
-    os.system('cp convert dist/clipbox.app/Contents/Resources/convert')
     os.system('mkdir dist/clipbox.app/Contents/Frameworks/Python.framework/')
     os.system('cp -rf Python.framework/ dist/clipbox.app/Contents/Frameworks/Python.framework/')
     os.system('touch dist/clipbox.app/Contents/Resources/config.txt')
@@ -0,0 +1,115 @@
+#Pool of logged-in FTP sessions, shared by every paste upload.
+#Sessions are kept alive with NOOPs so a paste doesn't pay for connect + banner + USER/PASS.
+import threading
+import time
+
+from ftplib import FTP, all_errors, error_perm
+
+import metrics
+
+def _tell(fp):
+    #where fp is now, None for pipes and sockets that can't be read twice
+    try:
+        return fp.tell()
+    except (AttributeError, IOError, OSError):
+        return None
+
+class FTPPool(object):
+    def __init__(self, host, username, password, size=2, keepalive=30, timeout=30):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.size = size
+        self.keepalive = keepalive #seconds between NOOPs on idle sessions
+        self.timeout = timeout
+        self._idle = [] #list of (ftp_conn, last_used)
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(size)
+        self._closed = threading.Event()
+        self._keeper = threading.Thread(target=self._keepAlive)
+        self._keeper.daemon = True
+        self._keeper.start()
+
+    def connect(self):
+        ftp_conn = FTP(timeout=self.timeout)
+        with metrics.phase('connect'):
+            ftp_conn.connect(self.host)
+        with metrics.phase('auth'):
+            ftp_conn.login(self.username, self.password)
+        return ftp_conn
+
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    ftp_conn, last_used = self._idle.pop()
+                if time.time() - last_used < self.keepalive or self._isAlive(ftp_conn):
+                    return ftp_conn
+                self._discard(ftp_conn) #stale session, try the next one
+            return self.connect()
+        except:
+            self._slots.release()
+            raise
+
+    def release(self, ftp_conn, broken=False):
+        try:
+            if broken or self._closed.is_set():
+                self._discard(ftp_conn)
+            else:
+                with self._lock:
+                    self._idle.append((ftp_conn, time.time()))
+        finally:
+            self._slots.release()
+
+    def storbinary(self, cmd, fp, blocksize=8192, callback=None):
+        #one retry on a fresh session if the pooled one went stale mid-command, when fp can be rewound
+        start = _tell(fp)
+        for attempt in (0, 1):
+            ftp_conn = self.acquire()
+            try:
+                with metrics.phase('transfer'):
+                    ftp_conn.storbinary(cmd, fp, blocksize, callback)
+            except all_errors as e:
+                self.release(ftp_conn, broken=True)
+                if attempt or isinstance(e, error_perm) or start is None:
+                    raise
+                fp.seek(start)
+            else:
+                self.release(ftp_conn)
+                return
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for ftp_conn, last_used in idle:
+            self._discard(ftp_conn)
+
+    def _isAlive(self, ftp_conn):
+        try:
+            ftp_conn.voidcmd('NOOP')
+            return True
+        except all_errors:
+            return False
+
+    def _discard(self, ftp_conn):
+        try:
+            ftp_conn.quit()
+        except all_errors:
+            ftp_conn.close()
+
+    def _keepAlive(self):
+        while not self._closed.wait(self.keepalive / 2.0):
+            with self._lock:
+                due = [entry for entry in self._idle if time.time() - entry[1] >= self.keepalive]
+                for entry in due:
+                    self._idle.remove(entry)
+            for ftp_conn, last_used in due:
+                if self._isAlive(ftp_conn):
+                    with self._lock:
+                        self._idle.append((ftp_conn, time.time()))
+                else:
+                    self._discard(ftp_conn)
@@ -0,0 +1,358 @@
+#Animated GIF encoding straight from raw RGB frames, one frame at a time, so a screencast can be
+#encoded while it is still being recorded instead of shelling out to convert afterwards.
+import collections
+import multiprocessing
+import struct
+import threading
+
+import numpy as np
+
+BAYER4 = np.array([[0, 8, 2, 10], [12, 4, 14, 6], [3, 11, 1, 9], [15, 7, 13, 5]])
+DITHER = ((BAYER4 + 0.5) / 16 * 8 - 4).astype(np.int16) #+-half a step of the 5 bit lookup grid
+
+def _rgb15(frame, dither=False):
+    #HxWx3 RGB -> HxW 15 bit color keys (5 bits per channel), optionally with ordered dithering
+    rgb = frame.astype(np.int16)
+    if dither:
+        height, width = frame.shape[:2]
+        offsets = np.tile(DITHER, ((height + 3) // 4, (width + 3) // 4))[:height, :width]
+        rgb = np.clip(rgb + offsets[..., None], 0, 255)
+    rgb >>= 3
+    return (rgb[..., 0] << 10) | (rgb[..., 1] << 5) | rgb[..., 2]
+
+def median_cut(frames, colors=255, step=4):
+    #palette of up to colors entries for a sample of frames: median cut over a 15 bit color histogram
+    keys = np.concatenate([_rgb15(frame[::step, ::step]).ravel() for frame in frames])
+    counts = np.bincount(keys, minlength=32768)
+    present = np.flatnonzero(counts)
+    rgb = np.stack([(present >> 10) & 31, (present >> 5) & 31, present & 31], axis=1)
+    weights = counts[present]
+    def span(box):
+        ranges = rgb[box].max(axis=0) - rgb[box].min(axis=0)
+        return ranges.max(), int(ranges.argmax())
+    boxes = [np.arange(len(present))]
+    spans = [span(boxes[0])]
+    while len(boxes) < colors:
+        #split the box with the widest channel range at its weighted median
+        widest = max(range(len(boxes)), key=lambda i: spans[i][0])
+        if spans[widest][0] == 0:
+            break
+        box = boxes.pop(widest)
+        channel = spans.pop(widest)[1]
+        box = box[np.argsort(rgb[box, channel], kind='mergesort')]
+        cumulative = np.cumsum(weights[box])
+        cut = int(np.searchsorted(cumulative, cumulative[-1] / 2.0)) + 1
+        cut = min(max(cut, 1), len(box) - 1)
+        boxes.extend([box[:cut], box[cut:]])
+        spans.extend([span(box[:cut]), span(box[cut:])])
+    palette = np.array([np.average(rgb[box], axis=0, weights=weights[box]) for box in boxes])
+    return (palette * 8 + 4).clip(0, 255).astype(np.uint8)
+
+def color_grid(colors):
+    #the largest uniform levels x levels x levels RGB grid that fits in colors entries
+    levels = int(round(colors ** (1 / 3.0)))
+    while levels ** 3 > colors:
+        levels -= 1
+    steps = np.linspace(0, 255, levels).round().astype(np.uint8)
+    return np.stack(np.meshgrid(steps, steps, steps, indexing='ij'), axis=-1).reshape(-1, 3)
+
+class Palette(object):
+    #A fixed palette plus a 32768 entry lookup table from 15 bit color to nearest palette index,
+    #so mapping a frame is a couple of shifts and one table lookup per pixel.
+    def __init__(self, colors):
+        self.colors = np.zeros((256, 3), np.uint8)
+        self.colors[:len(colors)] = colors
+        keys = np.arange(32768)
+        grid = np.stack([(keys >> 10) & 31, (keys >> 5) & 31, keys & 31], axis=1) * 8 + 4
+        self.lut = np.empty(32768, np.uint8)
+        palette = colors.astype(np.int32)
+        for start in range(0, 32768, 4096):
+            diff = grid[start:start + 4096, None, :] - palette[None, :, :]
+            self.lut[start:start + 4096] = (diff * diff).sum(axis=2).argmin(axis=1)
+
+    @classmethod
+    def from_frames(cls, frames, colors=255, reserve=64):
+        #median cut of frames, with at least reserve entries (and whatever median cut leaves
+        #unused) going to a uniform color grid, for colors that show up only after the sample
+        fitted = median_cut(frames, colors - reserve)
+        return cls(np.concatenate([fitted, color_grid(colors - len(fitted))]))
+
+    def quantize(self, frame, dither=False):
+        #HxWx3 RGB -> HxW palette indices
+        return self.lut[_rgb15(frame, dither)]
+
+def lzw_encode(indices, min_code_size=8):
+    #GIF flavoured variable-width LZW of a flat uint8 array, already split into data sub-blocks
+    data = bytearray(np.ascontiguousarray(indices).tostring())
+    clear = 1 << min_code_size
+    eoi = clear + 1
+    out = bytearray()
+    acc = 0
+    nbits = 0
+    code_size = min_code_size + 1
+    next_code = eoi + 1
+    table = {}
+
+    acc |= clear << nbits
+    nbits += code_size
+    if data:
+        prefix = data[0]
+        for c in data[1:]:
+            key = (prefix << 8) | c
+            code = table.get(key)
+            if code is not None:
+                prefix = code
+                continue
+            acc |= prefix << nbits
+            nbits += code_size
+            while nbits >= 8:
+                out.append(acc & 0xff)
+                acc >>= 8
+                nbits -= 8
+            if next_code < 4096:
+                table[key] = next_code
+                next_code += 1
+                if next_code > (1 << code_size) and code_size < 12:
+                    code_size += 1
+            else:
+                #table is full, start over
+                acc |= clear << nbits
+                nbits += code_size
+                table = {}
+                code_size = min_code_size + 1
+                next_code = eoi + 1
+            prefix = c
+        acc |= prefix << nbits
+        nbits += code_size
+    acc |= eoi << nbits
+    nbits += code_size
+    while nbits > 0:
+        out.append(acc & 0xff)
+        acc >>= 8
+        nbits -= 8
+
+    blocks = bytearray([min_code_size])
+    for start in range(0, len(out), 255):
+        chunk = out[start:start + 255]
+        blocks.append(len(chunk))
+        blocks += chunk
+    blocks.append(0)
+    return bytes(blocks)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def encode_pool():
+    #worker processes for lzw_encode, shared by every GIF being encoded and started the first time
+    #one is needed. LZW is pure Python, so threads would just take turns on the GIL.
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = multiprocessing.Pool(max(1, multiprocessing.cpu_count() - 1))
+        return _pool
+
+class GifWriter(object):
+    #Writes a looping GIF89a to fp frame by frame. Frames are HxW palette indices; palette is a
+    #256x3 uint8 global color table. With a pool frames are LZW encoded in its worker processes,
+    #up to max_queued at a time, and written out in order as they finish.
+    def __init__(self, fp, width, height, palette, loop=0, pool=None, max_queued=8):
+        self.fp = fp
+        self.width = width
+        self.height = height
+        self.pool = pool
+        self.max_queued = max_queued
+        self._queued = collections.deque() #(frame header, AsyncResult of its image data)
+        fp.write(b'GIF89a')
+        fp.write(struct.pack('<HHBBB', width, height, 0xF7, 0, 0)) #global table of 256 colors
+        fp.write(np.ascontiguousarray(palette, np.uint8).tostring())
+        fp.write(b'\x21\xFF\x0BNETSCAPE2.0\x03\x01' + struct.pack('<H', loop) + b'\x00')
+
+    def add_frame(self, indices, delay, x=0, y=0, transparent=None, disposal=1):
+        #delay is in hundredths of a second
+        height, width = indices.shape
+        flags = (disposal << 2) | (1 if transparent is not None else 0)
+        header = (struct.pack('<BBBBHBB', 0x21, 0xF9, 4, flags, delay, transparent or 0, 0) +
+                  struct.pack('<BHHHHB', 0x2C, x, y, width, height, 0))
+        if self.pool is None:
+            self.fp.write(header)
+            self.fp.write(lzw_encode(indices))
+            return
+        self._queued.append((header, self.pool.apply_async(lzw_encode, (np.ascontiguousarray(indices),))))
+        self._flush(self.max_queued)
+
+    def _flush(self, keep=0):
+        #write out finished frames, waiting on the oldest one while more than keep are queued
+        while self._queued and (len(self._queued) > keep or self._queued[0][1].ready()):
+            header, result = self._queued.popleft()
+            self.fp.write(header)
+            self.fp.write(result.get())
+
+    def close(self):
+        try:
+            self._flush()
+            self.fp.write(b'\x3B')
+        finally:
+            self.fp.close()
+
+def mask_box(mask):
+    #(top, left, bottom, right) around every True pixel of a HxW mask, None if there are none
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(mask[rows[0]:rows[-1] + 1].any(axis=0))
+    return rows[0], cols[0], rows[-1] + 1, cols[-1] + 1
+
+def changed_box(prev, cur):
+    #(top, left, bottom, right) around every pixel that differs between two frames, None if identical
+    return mask_box(prev != cur)
+
+def motion_box(ring):
+    #(top, left, bottom, right) around everything that moved during a finished recording, None if
+    #nothing did. A pixel that changes at any point differs from the first frame at some point.
+    count = ring.wait_closed()
+    if count < 2:
+        return None
+    first = ring.peek(0)
+    moved = np.zeros(first.shape[:2], bool)
+    for n in range(1, count):
+        moved |= (ring.peek(n) != first).any(axis=2)
+    return mask_box(moved)
+
+TRANSPARENT = 255 #palette slot kept free to mark "unchanged" pixels in delta frames
+
+class GifEncoder(threading.Thread):
+    #Background stage that takes frames off a screencast FrameRing as soon as they are captured,
+    #quantizes and LZW encodes them, and appends them to the GIF. One global palette is built from
+    #the first palette_sample frames (with crop_to_motion, palette_sample frames spread over the whole
+    #recording) and every frame is mapped through it, see Palette.from_frames. After the first frame only
+    #the rectangle that changed is written (unchanged pixels inside it made transparent). Frames
+    #where no more than merge_pixels pixels changed just lengthen the previous one, unless the
+    #recording ends on one. Each frame is held back until the next one arrives, and shown for the
+    #time between their capture timestamps, so playback runs at the speed it was recorded at even
+    #when capture was late or dropped frames.
+    #With crop_to_motion nothing is encoded until the recording ends, then every frame is cut down
+    #to the motion_box of the whole recording. pool is passed on to the GifWriter.
+    def __init__(self, ring, path, fps, delta=True, dither=False, palette_sample=3, crop_to_motion=False,
+                 merge_pixels=16, pool=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.ring = ring
+        self.path = path
+        self.interval = 1.0 / fps #how long the last frame stays up
+        self.delta = delta
+        self.dither = dither
+        self.palette_sample = palette_sample
+        self.crop_to_motion = crop_to_motion
+        self.merge_pixels = merge_pixels
+        self.pool = pool
+        self.box = None #(top, left, bottom, right) frames are cropped to
+        self.frames = 0 #frames written
+        self.skipped = 0 #(near) identical frames folded into the previous one
+        self.error = None
+        self._cancelled = False
+        self._writer = None
+        self._palette = None
+        self._pending = None #[indices, x, y, transparent] waiting for the next frame to fix its delay
+        self._prev = None
+        self._held = None #(indices, timestamp) of the latest frame merged away while still differing
+        self._start = None #timestamp of the first frame
+        self._last = None #timestamp of the latest frame
+        self._elapsed = 0 #hundredths of a second of frames written so far
+
+    def run(self):
+        sample = [] #(raw frame, timestamp) held until there are enough to build the palette from
+        try:
+            if self.crop_to_motion:
+                self.box = motion_box(self.ring)
+                count = self.ring.wait_closed()
+                if count:
+                    spread = np.linspace(0, count - 1, min(count, self.palette_sample)).round().astype(int)
+                    self._startGif([self._crop(self.ring.peek(n)) for n in sorted(set(spread))])
+            while True:
+                item = self.ring.take()
+                if item is None or self._cancelled:
+                    break
+                frame, timestamp = item
+                frame = self._crop(frame)
+                if self._palette is None:
+                    sample.append((frame.copy(), timestamp))
+                    self.ring.release()
+                    if len(sample) < self.palette_sample:
+                        continue
+                    self._startGif([frame for frame, timestamp in sample])
+                    self._addSample(sample)
+                    sample = []
+                else:
+                    indices = self._palette.quantize(frame, self.dither)
+                    self.ring.release() #indices is a copy, the capture thread can have the slot back
+                    self._addIndices(indices, timestamp)
+            if self._cancelled:
+                return
+            if sample:
+                self._startGif([frame for frame, timestamp in sample])
+                self._addSample(sample)
+            if self._held is not None: #the recording ends on a small change, don't leave it out
+                self._addIndices(*self._held, merge=False)
+            if self._pending is not None:
+                self._write(self._pending, self._last + self.interval)
+        except Exception as e:
+            self.error = e
+        finally:
+            if self._writer is not None:
+                self._writer.close()
+
+    def cancel(self):
+        #stop after the current frame, leaving an unfinished file
+        self._cancelled = True
+
+    def _crop(self, frame):
+        if self.box is None:
+            return frame
+        top, left, bottom, right = self.box
+        return frame[top:bottom, left:right]
+
+    def _startGif(self, frames):
+        self._palette = Palette.from_frames(frames, colors=TRANSPARENT)
+        height, width = frames[0].shape[:2]
+        self._writer = GifWriter(open(self.path, 'wb'), width, height, self._palette.colors, pool=self.pool)
+
+    def _addSample(self, sample):
+        for frame, timestamp in sample:
+            self._addIndices(self._palette.quantize(frame, self.dither), timestamp)
+
+    def _addIndices(self, indices, timestamp, merge=True):
+        if self._start is None:
+            self._start = timestamp
+        self._last = timestamp
+        prev = self._prev
+        if prev is not None:
+            diff = prev != indices
+            changed = np.count_nonzero(diff)
+            if merge and changed <= self.merge_pixels:
+                #keep showing the previous frame; the next real change is diffed against it, so the
+                #few pixels left out here still catch up then, or at the end of the recording
+                self._held = (indices, timestamp) if changed else None
+                self.skipped += 1
+                return
+        self._held = None
+        if prev is None or not self.delta:
+            piece = [indices, 0, 0, None]
+        else:
+            top, left, bottom, right = mask_box(diff)
+            sub = indices[top:bottom, left:right].copy()
+            sub[~diff[top:bottom, left:right]] = TRANSPARENT
+            piece = [sub, left, top, TRANSPARENT]
+        if self._pending is not None:
+            self._write(self._pending, timestamp)
+        self._pending = piece
+        self._prev = indices
+
+    def _write(self, piece, end):
+        #the frame is shown until end. Delays are worked out against the start of the recording
+        #so rounding to hundredths doesn't add up over a long GIF; 2 is the shortest delay
+        #browsers honour, anything less they slow down to 10.
+        indices, x, y, transparent = piece
+        delay = max(2, int(round((end - self._start) * 100)) - self._elapsed)
+        self._elapsed += delay
+        self._writer.add_frame(indices, delay, x, y, transparent)
+        self.frames += 1
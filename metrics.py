@@ -0,0 +1,116 @@
+#Per-paste timing: how long each phase of a paste took, kept in a rolling store for /metrics.json.
+#Code deep in the upload path (FTP pool, backends) reports into the timer of the paste the current
+#thread is working on, so nothing has to pass it around explicitly.
+import collections
+import threading
+import time
+from contextlib import contextmanager
+
+_current = threading.local()
+
+class PasteTimer(object):
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        self.started = time.time()
+        self.phases = collections.OrderedDict() #phase -> seconds, e.g. clipboard, encode, connect, auth, transfer, publish
+        self.bytes_sent = 0
+        self.info = {} #anything else worth knowing, e.g. encoded_bytes or dedup hits
+        self._lock = threading.Lock() #multi-file pastes report from several threads
+
+    @contextmanager
+    def phase(self, name):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - started)
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def sent(self, nbytes):
+        with self._lock:
+            self.bytes_sent += nbytes
+
+    def record(self, error=None, attempts=1):
+        total = time.time() - self.started
+        transfer = self.phases.get('transfer', 0)
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'started': self.started,
+            'total': total,
+            'phases': collections.OrderedDict(self.phases),
+            'bytes_sent': self.bytes_sent,
+            'bytes_per_sec': self.bytes_sent / transfer if transfer else None,
+            'attempts': attempts,
+            'error': error,
+            'info': self.info,
+        }
+
+class MetricsStore(object):
+    #the last max_records finished pastes
+    def __init__(self, max_records=200, slow_seconds=5):
+        self.slow_seconds = slow_seconds
+        self._records = collections.deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        record['slow'] = record['total'] >= self.slow_seconds
+        with self._lock:
+            self._records.append(record)
+        if record['slow']:
+            print "slow paste %s (%.1fs): %s" % (record['name'], record['total'],
+                ', '.join('%s %.2fs' % item for item in sorted(record['phases'].items(), key=lambda item: -item[1])))
+
+    def recent(self, slow_only=False):
+        with self._lock:
+            records = list(self._records)
+        if slow_only:
+            records = [record for record in records if record['slow']]
+        return records
+
+    def summary(self):
+        records = self.recent()
+        phases = collections.defaultdict(list)
+        for record in records:
+            for name, seconds in record['phases'].items():
+                phases[name].append(seconds)
+        return {
+            'pastes': len(records),
+            'slow': sum(1 for record in records if record['slow']),
+            'failed': sum(1 for record in records if record['error']),
+            'avg_phases': dict((name, sum(values) / len(values)) for name, values in phases.items()),
+        }
+
+def use(timer):
+    #make timer the one phase() and transferred() report to on this thread (None to stop)
+    _current.timer = timer
+
+def current():
+    return getattr(_current, 'timer', None)
+
+@contextmanager
+def phase(name):
+    timer = current()
+    if timer is None:
+        yield
+    else:
+        with timer.phase(name):
+            yield
+
+def sent(nbytes):
+    timer = current()
+    if timer is not None:
+        timer.sent(nbytes)
+
+def transferred(block):
+    #storbinary-style callback, counts the bytes of each block sent
+    sent(len(block))
+
+def note(key, value):
+    timer = current()
+    if timer is not None:
+        timer.info[key] = value
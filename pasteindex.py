@@ -0,0 +1,92 @@
+#Content-hash index of what has already been uploaded, so a repeat paste reuses the old URL.
+import hashlib
+import json
+import os
+import threading
+import time
+
+def file_digest(path, blocksize=1024*1024):
+    sha = hashlib.sha256()
+    fp = open(path, 'rb')
+    try:
+        for block in iter(lambda: fp.read(blocksize), b''):
+            sha.update(block)
+    finally:
+        fp.close()
+    return sha.hexdigest()
+
+def data_digest(*chunks):
+    sha = hashlib.sha256()
+    for chunk in chunks:
+        sha.update(chunk)
+    return sha.hexdigest()
+
+class PasteIndex(object):
+    #sha256 -> remote name/URL, per backend location. Least recently used entries are evicted past
+    #max_entries. Hits are trusted without any I/O unless the entry hasn't been checked against the
+    #backend for verify_after seconds, in which case a missing remote file turns the hit into a miss.
+    def __init__(self, path, max_entries=1000, verify_after=7*24*3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.verify_after = verify_after
+        self._lock = threading.Lock()
+        self._entries = {}
+        try:
+            spdatafile = open(path, 'r')
+            self._entries = json.loads(spdatafile.read())
+            spdatafile.close()
+        except (IOError, ValueError):
+            pass
+
+    def _key(self, digest, backend):
+        return digest + ' ' + backend.public_url('') #same content on another backend is a different entry
+
+    def peek(self, digest, backend):
+        #(name, url) of an entry without checking it against the backend, None if there is none
+        with self._lock:
+            entry = self._entries.get(self._key(digest, backend))
+        if entry is None:
+            return None
+        return entry['name'], entry['url']
+
+    def lookup(self, digest, backend):
+        key = self._key(digest, backend)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        now = time.time()
+        if now - entry['verified'] >= self.verify_after:
+            if not backend.exists(entry['name']):
+                with self._lock:
+                    self._entries.pop(key, None)
+                    self._save()
+                return None
+            entry['verified'] = now
+        with self._lock:
+            entry['used'] = now
+            self._save()
+        return entry['url']
+
+    def add(self, digest, backend, name, url):
+        now = time.time()
+        key = self._key(digest, backend)
+        location = self._key('', backend)
+        with self._lock:
+            #name now holds this content, whatever other content was uploaded under it is gone
+            for other in [other for other, entry in self._entries.items()
+                          if entry['name'] == name and other != key and other.endswith(location)]:
+                del self._entries[other]
+            self._entries[key] = {'name': name, 'url': url, 'used': now, 'verified': now}
+            if len(self._entries) > self.max_entries:
+                by_age = sorted(self._entries, key=lambda key: self._entries[key]['used'])
+                for key in by_age[:len(self._entries) - self.max_entries]:
+                    del self._entries[key]
+            self._save()
+
+    def _save(self):
+        tmppath = self.path + '.tmp'
+        spdatafile = open(tmppath, 'w')
+        spdatafile.write(json.dumps(self._entries))
+        spdatafile.close()
+        os.rename(tmppath, self.path)
@@ -0,0 +1,546 @@
+#In-process screen recording: a grabber copies the screen into a preallocated ring of raw RGB
+#frames while CaptureEngine keeps the capture loop on a steady frame rate. ScreencastSession ties
+#a recording to its encoder. Screenshotters take single PNG screenshots for the screenshot hotkey.
+import collections
+import ctypes
+import ctypes.util
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from gifencoder import GifEncoder, encode_pool
+from videoencoder import FfmpegEncoder
+
+def _clock():
+    #time.monotonic doesn't exist on 2.7, go straight to clock_gettime when we can
+    try:
+        return time.monotonic
+    except AttributeError:
+        pass
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+        CLOCK_MONOTONIC = 6 if sys.platform == 'darwin' else 1
+        ts = timespec()
+        if libc.clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+            raise OSError()
+        def monotonic():
+            libc.clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts))
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+        return monotonic
+    except (OSError, AttributeError, TypeError):
+        return time.time
+
+monotonic = _clock()
+
+class Grabber(object):
+    #grab(out) copies the current screen into out, an HxWx3 uint8 array of self.size()
+    def size(self):
+        raise NotImplementedError
+
+    def grab(self, out):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class QuartzGrabber(Grabber):
+    #main display on OS X, straight out of CoreGraphics without screencapture or a PNG.
+    #region is (x, y, width, height) in points to grab just that part of the screen.
+    def __init__(self, region=None):
+        import Quartz
+        self.Quartz = Quartz
+        if region is None:
+            self.rect = Quartz.CGDisplayBounds(Quartz.CGMainDisplayID())
+        else:
+            self.rect = Quartz.CGRectMake(*region)
+        image = self._image()
+        self._size = (Quartz.CGImageGetWidth(image), Quartz.CGImageGetHeight(image)) #pixels, so 2x points on Retina
+
+    def _image(self):
+        Quartz = self.Quartz
+        return Quartz.CGWindowListCreateImage(self.rect, Quartz.kCGWindowListOptionOnScreenOnly,
+                                              Quartz.kCGNullWindowID, Quartz.kCGWindowImageDefault)
+
+    def size(self):
+        return self._size
+
+    def grab(self, out):
+        Quartz = self.Quartz
+        image = self._image()
+        width, height = self._size
+        rowbytes = Quartz.CGImageGetBytesPerRow(image)
+        data = Quartz.CGDataProviderCopyData(Quartz.CGImageGetDataProvider(image))
+        bgra = np.frombuffer(data, np.uint8).reshape(height, rowbytes // 4, 4)
+        out[...] = bgra[:, :width, 2::-1]
+
+class _XImage(ctypes.Structure):
+    _fields_ = [('width', ctypes.c_int), ('height', ctypes.c_int), ('xoffset', ctypes.c_int),
+                ('format', ctypes.c_int), ('data', ctypes.c_void_p), ('byte_order', ctypes.c_int),
+                ('bitmap_unit', ctypes.c_int), ('bitmap_bit_order', ctypes.c_int), ('bitmap_pad', ctypes.c_int),
+                ('depth', ctypes.c_int), ('bytes_per_line', ctypes.c_int), ('bits_per_pixel', ctypes.c_int),
+                ('red_mask', ctypes.c_ulong), ('green_mask', ctypes.c_ulong), ('blue_mask', ctypes.c_ulong)]
+
+class X11Grabber(Grabber):
+    #root window of an X display through Xlib (Xvfb works too, which is what CI runs), or just the
+    #(x, y, width, height) region of it
+    ZPixmap = 2
+    AllPlanes = 0xFFFFFFFF
+
+    def __init__(self, display=None, region=None):
+        path = ctypes.util.find_library('X11')
+        if path is None:
+            raise OSError('libX11 not found')
+        xlib = ctypes.cdll.LoadLibrary(path)
+        xlib.XOpenDisplay.restype = ctypes.c_void_p
+        xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        xlib.XDefaultRootWindow.restype = ctypes.c_ulong
+        xlib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        xlib.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        xlib.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        xlib.XGetImage.restype = ctypes.POINTER(_XImage)
+        xlib.XGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.c_int,
+                                   ctypes.c_uint, ctypes.c_uint, ctypes.c_ulong, ctypes.c_int]
+        xlib.XDestroyImage.argtypes = [ctypes.POINTER(_XImage)]
+        xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        self.xlib = xlib
+        self.display = xlib.XOpenDisplay(display)
+        if not self.display:
+            raise OSError('cannot open X display %s' % (display or ''))
+        screen = xlib.XDefaultScreen(self.display)
+        self.root = xlib.XDefaultRootWindow(self.display)
+        screen_size = (xlib.XDisplayWidth(self.display, screen), xlib.XDisplayHeight(self.display, screen))
+        if region is None:
+            region = (0, 0) + screen_size
+        x, y, width, height = [int(v) for v in region]
+        x, y = max(0, min(x, screen_size[0] - 1)), max(0, min(y, screen_size[1] - 1))
+        self._origin = (x, y)
+        self._size = (max(1, min(width, screen_size[0] - x)), max(1, min(height, screen_size[1] - y)))
+
+    def size(self):
+        return self._size
+
+    def grab(self, out):
+        width, height = self._size
+        ximage = self.xlib.XGetImage(self.display, self.root, self._origin[0], self._origin[1], width, height,
+                                     self.AllPlanes, self.ZPixmap)
+        if not ximage:
+            raise OSError('XGetImage failed')
+        try:
+            image = ximage.contents
+            if image.bits_per_pixel != 32:
+                raise OSError('unsupported X visual (%d bpp)' % image.bits_per_pixel)
+            buf = (ctypes.c_uint8 * (image.bytes_per_line * height)).from_address(image.data)
+            bgrx = np.frombuffer(buf, np.uint8).reshape(height, image.bytes_per_line // 4, 4)
+            out[...] = bgrx[:, :width, 2::-1]
+        finally:
+            self.xlib.XDestroyImage(ximage)
+
+    def close(self):
+        if self.display:
+            self.xlib.XCloseDisplay(self.display)
+            self.display = None
+
+def downscale(frame, factor, out=None):
+    #box filter: every factor x factor block of pixels averaged into one. Edge pixels that don't
+    #fill a whole block are dropped. Adding up the factor^2 strided views is several times faster
+    #than a reshape and sum over two axes, and the sums fit uint16 up to factor 16.
+    height, width = frame.shape[0] // factor, frame.shape[1] // factor
+    frame = frame[:height * factor, :width * factor]
+    sums = np.empty((height, width, 3), np.uint16)
+    sums.fill(factor * factor // 2) #round to nearest
+    for dy in range(factor):
+        for dx in range(factor):
+            sums += frame[dy::factor, dx::factor]
+    sums //= factor * factor
+    if out is None:
+        return sums.astype(np.uint8)
+    out[...] = sums
+    return out
+
+class ScaledGrabber(Grabber):
+    #wraps another grabber and shrinks its frames by factor in each direction (see downscale),
+    #so everything after capture - the ring, quantizing, LZW, upload - handles factor^2 fewer pixels
+    def __init__(self, grabber, factor):
+        self.grabber = grabber
+        self.factor = factor
+        width, height = grabber.size()
+        self._full = np.empty((height, width, 3), np.uint8)
+
+    def size(self):
+        width, height = self.grabber.size()
+        return (width // self.factor, height // self.factor)
+
+    def grab(self, out):
+        self.grabber.grab(self._full)
+        downscale(self._full, self.factor, out)
+
+    def close(self):
+        self.grabber.close()
+
+def default_grabber(region=None):
+    if sys.platform == 'darwin':
+        return QuartzGrabber(region)
+    return X11Grabber(region=region)
+
+def png_bytes(frame, compression=6):
+    #HxWx3 RGB -> PNG file contents, no filtering, just zlib
+    height, width = frame.shape[:2]
+    rows = np.zeros((height, width * 3 + 1), np.uint8) #each row starts with filter type 0
+    rows[:, 1:] = frame.reshape(height, width * 3)
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(rows.tostring(), compression)) +
+            chunk(b'IEND', b''))
+
+class Screenshotter(object):
+    #shoot() returns the PNG bytes of a screenshot, or None if the user cancelled it
+    def shoot(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class ScreencaptureShotter(Screenshotter):
+    #OS X screencapture in interactive mode (drag out a rectangle, or space to pick a window),
+    #written to a private temp file that is read back and removed
+    def __init__(self, command=('screencapture', '-i', '-t', 'png')):
+        self.command = list(command)
+
+    def shoot(self):
+        fd, path = tempfile.mkstemp(prefix='clipbox-shot-', suffix='.png')
+        os.close(fd)
+        try:
+            subprocess.call(self.command + [path])
+            fp = open(path, 'rb')
+            try:
+                data = fp.read()
+            finally:
+                fp.close()
+            return data or None #Escape leaves the file empty
+        finally:
+            os.remove(path)
+
+class GrabberShotter(Screenshotter):
+    #one frame of a Grabber as a PNG: the whole X11 screen, or whatever a fake grabber returns
+    def __init__(self, grabber, compression=6):
+        self.grabber = grabber
+        self.compression = compression
+
+    def shoot(self):
+        width, height = self.grabber.size()
+        frame = np.empty((height, width, 3), np.uint8)
+        self.grabber.grab(frame)
+        return png_bytes(frame, self.compression)
+
+    def close(self):
+        self.grabber.close()
+
+def default_screenshotter(compression=6):
+    if sys.platform == 'darwin':
+        return ScreencaptureShotter()
+    return GrabberShotter(X11Grabber(), compression)
+
+class FrameRing(object):
+    #Up to capacity frames in flight between the capture thread and a consumer. The capture thread
+    #claims a slot, grabs straight into it and commits it; the consumer takes committed frames in
+    #order and releases them. Frames live in preallocated RAM slots, as many as fit in memory_limit
+    #bytes, and a released slot is reused for the next frame. Only while more frames are unreleased
+    #than that do they go to a memory-mapped temp file, grown a frame at a time as needed, so a long
+    #or high fps recording can't run the machine out of memory.
+    def __init__(self, capacity, height, width, memory_limit=None):
+        self.capacity = capacity
+        self.height = height
+        self.width = width
+        self._frame_bytes = height * width * 3
+        ram_slots = capacity if memory_limit is None else min(capacity, max(1, memory_limit // self._frame_bytes))
+        self.ram = np.empty((ram_slots, height, width, 3), np.uint8)
+        self.spill = [] #one memmap per frame slot in the spill file
+        self._spillfile = None
+        self._free_ram = collections.deque(range(ram_slots))
+        self._free_spill = collections.deque()
+        self._where = [None] * capacity #(array, slot) holding frame n, at n % capacity
+        self.timestamps = np.zeros(capacity)
+        self._head = 0 #next frame to fill
+        self._tail = 0 #next frame to hand to the consumer
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _slot(self, n):
+        array, i = self._where[n % self.capacity]
+        return array[i]
+
+    def _assign(self, n):
+        #find frame n a slot: a free RAM one if there is any, else one in the spill file
+        if self._free_ram:
+            self._where[n % self.capacity] = (self.ram, self._free_ram.popleft())
+            return
+        if not self._free_spill:
+            if self._spillfile is None:
+                self._spillfile = tempfile.NamedTemporaryFile(prefix='clipbox-frames-')
+            self._free_spill.append(len(self.spill))
+            self.spill.append(np.memmap(self._spillfile, np.uint8, 'r+', offset=len(self.spill) * self._frame_bytes,
+                                        shape=(self.height, self.width, 3)))
+        self._where[n % self.capacity] = (self.spill, self._free_spill.popleft())
+
+    def claim(self):
+        #the slot for the next frame, or None if the consumer has fallen a whole ring behind
+        with self._cond:
+            if self._head - self._tail >= self.capacity:
+                return None
+            if self._where[self._head % self.capacity] is None:
+                self._assign(self._head)
+            return self._slot(self._head)
+
+    def commit(self, timestamp):
+        with self._cond:
+            self.timestamps[self._head % self.capacity] = timestamp
+            self._head += 1
+            self._cond.notify_all()
+
+    def take(self):
+        #(frame, timestamp) of the oldest unread frame, blocks until there is one; None once closed and drained
+        with self._cond:
+            while self._tail == self._head and not self._closed:
+                self._cond.wait()
+            if self._tail == self._head:
+                return None
+            return self._slot(self._tail), self.timestamps[self._tail % self.capacity]
+
+    def wait_closed(self):
+        #blocks until capture has finished, returns how many frames are waiting
+        with self._cond:
+            while not self._closed:
+                self._cond.wait()
+            return self._head - self._tail
+
+    def peek(self, n):
+        #the nth unread frame, without taking it
+        return self._slot(self._tail + n)
+
+    def release(self):
+        with self._cond:
+            array, i = self._where[self._tail % self.capacity]
+            (self._free_ram if array is self.ram else self._free_spill).append(i)
+            self._where[self._tail % self.capacity] = None
+            self._tail += 1
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return self._head - self._tail
+
+    def free(self):
+        #drop the spill file once nobody needs the frames any more
+        if self._spillfile is not None:
+            self.spill = []
+            self._free_spill.clear()
+            self._spillfile.close()
+            self._spillfile = None
+
+class CaptureEngine(threading.Thread):
+    #Grabs up to max_frames frames at a steady fps into a FrameRing. Ticks are scheduled against
+    #the monotonic clock, so a slow grab shortens the next sleep instead of pushing every later frame back.
+    def __init__(self, grabber, fps=3, max_frames=45, ring=None, memory_limit=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.grabber = grabber
+        self.fps = fps
+        self.max_frames = max_frames
+        width, height = grabber.size()
+        self.ring = ring or FrameRing(max_frames, height, width, memory_limit)
+        self.captured = []
+        self.dropped = 0
+        self.error = None
+        self._halt = threading.Event()
+
+    def stop(self):
+        self._halt.set()
+
+    def run(self):
+        interval = 1.0 / self.fps
+        next_tick = monotonic()
+        try:
+            while not self._halt.is_set() and len(self.captured) < self.max_frames:
+                slot = self.ring.claim()
+                now = monotonic()
+                if slot is None:
+                    self.dropped += 1
+                else:
+                    self.grabber.grab(slot)
+                    self.ring.commit(now)
+                    self.captured.append(now)
+                next_tick += interval
+                delay = next_tick - monotonic()
+                if delay > 0:
+                    self._halt.wait(delay)
+                else:
+                    next_tick = monotonic() #fell behind, don't try to catch up in a burst
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ring.close()
+            self.grabber.close()
+
+    def stats(self):
+        #achieved fps and frame interval jitter (std dev, ms) of what was actually captured
+        stamps = np.array(self.captured)
+        if len(stamps) < 2:
+            return {'frames': len(stamps), 'dropped': self.dropped, 'fps': 0.0, 'jitter_ms': 0.0}
+        intervals = np.diff(stamps)
+        return {
+            'frames': len(stamps),
+            'dropped': self.dropped,
+            'fps': (len(stamps) - 1) / (stamps[-1] - stamps[0]),
+            'jitter_ms': float(intervals.std() * 1000),
+        }
+
+RECORDING, ENCODING, UPLOADING, DONE, CANCELLED, FAILED = 'recording', 'encoding', 'uploading', 'done', 'cancelled', 'failed'
+
+class ScreencastSession(threading.Thread):
+    #One screencast from the first frame to the uploaded file, in a temp directory of its own so
+    #back to back recordings never share files. Several sessions can be encoding at once, GIF LZW
+    #work goes to the shared gifencoder.encode_pool. on_change(session, state) is called from the
+    #session thread as it moves through RECORDING, ENCODING and UPLOADING; whoever uploads the
+    #result calls finished() for DONE (or FAILED). cancel() ends it as CANCELLED at any point.
+    #Video is streamed out of self.stream while recording, so upload starts at RECORDING there.
+    def __init__(self, paste_id, on_change, fps=3, max_seconds=15, scale=1, region=None, format='gif',
+                 memory_limit=None, dither=False, crop_to_motion=False, ffmpeg='ffmpeg', start_delay=1):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.paste_id = paste_id
+        self.on_change = on_change
+        self.fps = fps
+        self.max_seconds = max_seconds
+        self.scale = scale
+        self.region = region
+        self.format = format
+        self.memory_limit = memory_limit
+        self.dither = dither
+        self.crop_to_motion = crop_to_motion
+        self.ffmpeg = ffmpeg
+        self.start_delay = start_delay
+        self.filename = paste_id + '.' + format
+        self.directory = tempfile.mkdtemp(prefix='clipbox-screencast-')
+        self.path = os.path.join(self.directory, self.filename)
+        self.state = None
+        self.error = None
+        self.engine = None
+        self.encoder = None
+        self.stream = None
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._stopped = threading.Event() #set by stop() and cancel(), even before there is an engine to stop
+
+    def video(self):
+        return self.format != 'gif'
+
+    def active(self):
+        return self.state not in (DONE, CANCELLED, FAILED)
+
+    def _set(self, state):
+        #terminal states stick, an upload can finish before the encoder thread gets here
+        with self._lock:
+            if not self.active():
+                return False
+            self.state = state
+        if not self.active():
+            shutil.rmtree(self.directory, ignore_errors=True)
+        self.on_change(self, state)
+        return True
+
+    def stop(self):
+        #stop recording early, what was captured so far is still encoded and uploaded; before
+        #the first frame that is the same as cancel()
+        self._stopped.set()
+        if self.engine is not None:
+            self.engine.stop()
+
+    def cancel(self):
+        self._cancelled.set()
+        self.stop()
+        if self.encoder is not None:
+            self.encoder.cancel()
+        self._set(CANCELLED)
+
+    def finished(self, error=None):
+        if error is not None: #the upload gave up, nobody is reading what we would record
+            self.stop()
+            if self.encoder is not None:
+                self.encoder.cancel()
+        self._set(FAILED if error is not None else DONE)
+
+    def encoded(self):
+        #wait for the encoder, then the error that spoiled the result, if any. A streamed upload
+        #reaching EOF only means ffmpeg's stdout closed, not that the whole video made it.
+        self.encoder.join()
+        return self.engine.error or self.encoder.error
+
+    def run(self):
+        try:
+            self._stopped.wait(self.start_delay) #don't record the hotkey being let go
+            if self._stopped.is_set():
+                self._set(CANCELLED)
+                return
+            grabber = default_grabber(self.region)
+            if self.scale > 1:
+                grabber = ScaledGrabber(grabber, self.scale)
+            self.engine = CaptureEngine(grabber, fps=self.fps, max_frames=int(self.fps * self.max_seconds),
+                                        memory_limit=self.memory_limit)
+            try:
+                if self.video():
+                    self.encoder = FfmpegEncoder(self.engine.ring, self.fps, self.format, self.ffmpeg)
+                    self.stream = self.encoder.stream
+                else:
+                    #merge_pixels counts frame pixels, a downscaled one covers scale x scale screen pixels
+                    self.encoder = GifEncoder(self.engine.ring, self.path, self.engine.fps, dither=self.dither,
+                                              crop_to_motion=self.crop_to_motion, pool=encode_pool(),
+                                              merge_pixels=16 // (self.scale * self.scale))
+            except Exception:
+                grabber.close()
+                self.engine.ring.free()
+                raise
+            if self._stopped.is_set(): #stop() or cancel() came while we were setting up
+                grabber.close()
+                self.encoder.cancel()
+                self.engine.ring.free()
+                self._set(CANCELLED)
+                return
+            self.engine.start()
+            self.encoder.start()
+            self._set(RECORDING)
+            while self.engine.is_alive():
+                self.engine.join(0.1)
+                if not self.encoder.is_alive(): #encoder died, nothing takes frames off the ring any more
+                    self.engine.stop()
+            if self._stopped.is_set() and not self.engine.captured:
+                self.cancel() #stopped before the first frame, there is nothing to upload
+            print "screencast: %(frames)d frames at %(fps).2f fps, %(jitter_ms).1fms jitter, %(dropped)d dropped" % self.engine.stats()
+            self._set(ENCODING)
+            self.encoder.join()
+            self.engine.ring.free()
+            self.error = self.engine.error or self.encoder.error
+            if self.error is not None:
+                self._set(FAILED)
+            else:
+                self._set(UPLOADING)
+        except Exception as e:
+            self.error = e
+            self._set(FAILED)
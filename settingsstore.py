@@ -0,0 +1,195 @@
+#The parsed config.txt, kept in memory. A watcher thread polls the file's mtime and reparses only
+#when it changed, so the settings page and the upload path never touch the disk or the JSON parser.
+import hashlib
+import json
+import os
+import threading
+
+TRUE = ('true', '1', 'yes', 'on')
+FALSE = ('false', '0', 'no', 'off', '')
+
+class SettingsSnapshot(dict):
+    #one version of the settings; read-only, so whoever holds it sees a consistent set
+    def __init__(self, values, version):
+        dict.__init__(self, values)
+        self.version = version
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('settings are read-only, save new ones through SettingsStore.write')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+class SettingsStore(object):
+    #settings is defaults overlaid with the file as a SettingsSnapshot, replaced (never modified)
+    #on every change, so readers need no lock. Only keys in defaults are settings. Values are
+    #coerced to the type of their default and checked against choices (key -> allowed values),
+    #ranges (key -> (low, high)) and validators (key -> function(value) raising ValueError).
+    #script() is the /settings.js body, built once per change along with its ETag. Anything that
+    #has to react to new settings subscribe()s, see there.
+    def __init__(self, path, defaults, choices=None, ranges=None, validators=None, poll_interval=1.0):
+        self.path = path
+        self.defaults = defaults
+        self.choices = choices or {}
+        self.ranges = ranges or {}
+        self.validators = validators or {}
+        self.poll_interval = poll_interval
+        self.version = 0
+        self.settings = SettingsSnapshot(defaults, self.version)
+        self._listeners = [] #(listener, keys)
+        self._stamp = None #(mtime, size) of the file last read
+        self._script = None #(settings.js bytes, ETag), swapped as one
+        self._lock = threading.Lock()
+        self._writing = threading.Lock()
+        self._watcher = None
+        self._halt = threading.Event()
+        self._build('{}')
+
+    def _build(self, raw):
+        script = ("load_current_settings(" + json.dumps(raw) + ");").encode('utf-8')
+        self._script = (script, '"%s"' % hashlib.sha1(script).hexdigest())
+
+    def _statFile(self):
+        try:
+            stats = os.stat(self.path)
+        except OSError:
+            return None
+        return (stats.st_mtime, stats.st_size)
+
+    def _coerce(self, key, value):
+        #value as the type of the default for key, ValueError saying what is wrong with it
+        if key not in self.defaults:
+            raise ValueError('is not a setting')
+        default = self.defaults[key]
+        if value is None or isinstance(value, (dict, list)):
+            raise ValueError('must be a single value')
+        if isinstance(default, bool):
+            if not isinstance(value, bool):
+                text = unicode(value).strip().lower()
+                if text not in TRUE + FALSE:
+                    raise ValueError('must be true or false')
+                value = text in TRUE
+        elif isinstance(default, (int, float)):
+            if isinstance(value, bool): #float(True) would quietly make it 1
+                raise ValueError('must be a number')
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                raise ValueError('must be a number')
+            if number != number or number in (float('inf'), float('-inf')):
+                raise ValueError('must be a number')
+            value = int(number) if number.is_integer() else number
+        elif isinstance(value, bool):
+            raise ValueError('must be text')
+        elif not isinstance(value, basestring):
+            value = unicode(value)
+        if key in self.choices and value not in self.choices[key]:
+            raise ValueError('must be one of %s' % ', '.join(str(choice) for choice in self.choices[key]))
+        if key in self.ranges:
+            low, high = self.ranges[key]
+            if not low <= value <= high:
+                raise ValueError('must be between %s and %s' % (low, high))
+        if key in self.validators:
+            self.validators[key](value)
+        return value
+
+    def validate(self, values):
+        #(values coerced, list of problems); keys with a problem are left out
+        if not isinstance(values, dict):
+            return {}, ['settings must be a JSON object']
+        coerced = {}
+        errors = []
+        for key, value in sorted(values.items()):
+            try:
+                coerced[key] = self._coerce(key, value)
+            except ValueError as e:
+                errors.append('%s %s' % (key, e))
+        return coerced, errors
+
+    def _readFile(self):
+        try:
+            spdatafile = open(self.path, 'r')
+            raw = spdatafile.read()
+            spdatafile.close()
+        except IOError:
+            raw = '{}'
+        return raw
+
+    def reload(self, force=False):
+        #reread the file if it changed since last time, True if the settings did
+        with self._lock:
+            stamp = self._statFile()
+            if stamp == self._stamp and not force:
+                return False
+            self._stamp = stamp
+            raw = self._readFile()
+            self._build(raw)
+            try:
+                values = json.loads(raw)
+            except ValueError as e:
+                print "config.txt is not valid JSON, keeping the previous settings: %s" % e
+                return False
+            values, errors = self.validate(values)
+            for error in errors:
+                print "config.txt: %s, using the default" % error
+            old = self.settings
+            self.version += 1
+            settings = self.settings = SettingsSnapshot(dict(self.defaults, **values), self.version)
+        changed = set(key for key in set(old) | set(settings) if old.get(key) != settings.get(key))
+        for listener, keys in list(self._listeners):
+            if keys is None or keys & changed:
+                try:
+                    listener(settings)
+                except Exception as e:
+                    print "settings listener %r failed: %r" % (listener, e)
+        return True
+
+    def subscribe(self, listener, keys=None):
+        #listener(settings) after every change, or only when one of keys changed. Called on
+        #whichever thread did the reload, so UI listeners should hop over with wx.CallAfter.
+        self._listeners.append((listener, frozenset(keys) if keys is not None else None))
+
+    def script(self):
+        #(settings.js bytes, ETag)
+        return self._script
+
+    def write(self, raw):
+        #Validate raw JSON and save the coerced values over what the file has, so keys that weren't
+        #posted keep their values: temp file, fsync, rename, so a crash or a concurrent save never
+        #leaves it half written. Returns the list of problems, empty if it was saved.
+        try:
+            values = json.loads(raw)
+        except (TypeError, ValueError) as e:
+            return ['not valid JSON: %s' % e]
+        values, errors = self.validate(values)
+        if errors:
+            return errors
+        with self._writing:
+            try:
+                current = json.loads(self._readFile())
+            except ValueError:
+                current = {} #not JSON, nothing worth keeping
+            if not isinstance(current, dict):
+                current = {}
+            current.update(values)
+            tmppath = self.path + '.tmp'
+            spdatafile = open(tmppath, 'w')
+            spdatafile.write(json.dumps(current, sort_keys=True))
+            spdatafile.flush()
+            os.fsync(spdatafile.fileno())
+            spdatafile.close()
+            os.rename(tmppath, self.path)
+        self.reload(force=True)
+        return []
+
+    def watch(self):
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._poll)
+            self._watcher.daemon = True
+            self._watcher.start()
+
+    def _poll(self):
+        while not self._halt.wait(self.poll_interval):
+            self.reload()
+
+    def close(self):
+        self._halt.set()
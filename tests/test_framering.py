@@ -0,0 +1,70 @@
+from screencast import FrameRing
+
+FRAME_BYTES = 4 * 6 * 3
+
+def fill(ring, value, timestamp):
+    slot = ring.claim()
+    slot[...] = value
+    ring.commit(timestamp)
+
+def drain(ring):
+    values = []
+    while True:
+        item = ring.take()
+        if item is None:
+            return values
+        values.append(int(item[0][0, 0, 0]))
+        ring.release()
+
+def test_frames_come_out_in_order():
+    ring = FrameRing(5, 4, 6)
+    for i in range(5):
+        fill(ring, i, i * 0.1)
+    assert len(ring) == 5
+    frame, timestamp = ring.take()
+    assert (frame == 0).all() and timestamp == 0
+    ring.release()
+    ring.close()
+    assert drain(ring) == [1, 2, 3, 4]
+
+def test_claim_fails_when_a_whole_ring_behind():
+    ring = FrameRing(3, 4, 6)
+    for i in range(3):
+        fill(ring, i, i)
+    assert ring.claim() is None
+    ring.take()
+    ring.release()
+    assert ring.claim() is not None
+
+def test_released_ram_slots_are_reused():
+    ring = FrameRing(100, 4, 6, memory_limit=FRAME_BYTES * 2)
+    for i in range(50):
+        fill(ring, i, i)
+        frame, timestamp = ring.take()
+        assert frame[0, 0, 0] == i
+        ring.release()
+    assert ring.spill == [] and ring._spillfile is None
+
+def test_spills_only_the_backlog_past_the_budget():
+    ring = FrameRing(100, 4, 6, memory_limit=FRAME_BYTES * 2)
+    for i in range(5):
+        fill(ring, i, i)
+    assert len(ring.spill) == 3
+    assert [int(ring.peek(n)[0, 0, 0]) for n in range(5)] == [0, 1, 2, 3, 4]
+    for i in range(5, 10):
+        ring.take()
+        ring.release()
+        fill(ring, i, i)
+    assert len(ring.spill) == 3 #freed spill slots were reused, the file didn't grow
+    ring.close()
+    assert drain(ring) == [5, 6, 7, 8, 9]
+    ring.free()
+    assert ring.spill == []
+
+def test_wait_closed_counts_unread_frames():
+    ring = FrameRing(10, 4, 6)
+    for i in range(4):
+        fill(ring, i, i)
+    ring.close()
+    assert ring.wait_closed() == 4
+    assert (ring.peek(3) == 3).all()
@@ -0,0 +1,81 @@
+import ftplib
+import io
+import socket
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('pyftpdlib')
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.servers import ThreadedFTPServer
+
+from backends import FTPBackend
+
+LOGIN_DELAY = 0.02 #stands in for a real server's connect + banner + USER/PASS round trips
+
+class SlowLoginHandler(FTPHandler):
+    logins = []
+
+    def ftp_PASS(self, line):
+        time.sleep(LOGIN_DELAY)
+        self.logins.append(time.time())
+        return FTPHandler.ftp_PASS(self, line)
+
+@pytest.fixture
+def server(tmpdir, monkeypatch):
+    root = tmpdir.mkdir('ftproot')
+    authorizer = DummyAuthorizer()
+    authorizer.add_user('user', 'secret', str(root), perm='elradfmwMT')
+    monkeypatch.setattr(SlowLoginHandler, 'authorizer', authorizer)
+    monkeypatch.setattr(SlowLoginHandler, 'logins', [])
+    ftpd = ThreadedFTPServer(('127.0.0.1', 0), SlowLoginHandler)
+    ftpd._exit = threading.Event() #shared by every ThreadedFTPServer otherwise, close_all() would stop the next test's
+    port = ftpd.socket.getsockname()[1]
+    thread = threading.Thread(target=ftpd.serve_forever, kwargs={'timeout': 0.1})
+    thread.daemon = True
+    thread.start()
+    connect = ftplib.FTP.connect
+    monkeypatch.setattr(ftplib.FTP, 'connect', lambda self, host='', port_=0, timeout=-999: connect(self, host, port))
+    yield root
+    ftpd.close_all()
+
+@pytest.fixture
+def backend(server):
+    settings = {'ftp_host': '127.0.0.1', 'ftp_username': 'user', 'ftp_password': 'secret',
+                'ftp_public_url': 'http://example.com/', 'ftp_remote_dir': ''}
+    backend = FTPBackend(settings)
+    yield backend
+    backend.close()
+
+def test_uploads_share_one_session(server, backend):
+    for i in range(10):
+        backend.upload(io.BytesIO(b'paste %d' % i), 'p%d.txt' % i)
+    assert [server.join('p%d.txt' % i).read() for i in range(10)] == ['paste %d' % i for i in range(10)]
+    assert len(SlowLoginHandler.logins) == 1
+
+def test_pooled_uploads_beat_a_connection_per_paste(server, backend):
+    #what onHotCopy used to do for every paste: connect, log in, STOR, quit
+    pastes = 10
+    started = time.time()
+    for i in range(pastes):
+        ftp_conn = ftplib.FTP()
+        ftp_conn.connect('127.0.0.1')
+        ftp_conn.login('user', 'secret')
+        ftp_conn.storbinary('STOR fresh%d.txt' % i, io.BytesIO(b'x' * 1000))
+        ftp_conn.quit()
+    fresh = (time.time() - started) / pastes
+    started = time.time()
+    for i in range(pastes):
+        backend.upload(io.BytesIO(b'x' * 1000), 'pooled%d.txt' % i)
+    pooled = (time.time() - started) / pastes
+    assert pooled < fresh / 2, 'pooled %.1fms vs fresh %.1fms per paste' % (pooled * 1000, fresh * 1000)
+
+def test_stale_session_is_replaced(server, backend):
+    backend.upload(io.BytesIO(b'first'), 'first.txt')
+    ftp_conn, last_used = backend.pool._idle[0]
+    ftp_conn.sock.shutdown(socket.SHUT_RDWR) #the server hung up while it sat in the pool
+    backend.upload(io.BytesIO(b'second'), 'second.txt')
+    assert server.join('second.txt').read() == 'second'
+    assert len(SlowLoginHandler.logins) == 2
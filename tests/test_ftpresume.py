@@ -0,0 +1,99 @@
+import ftplib
+import os
+import threading
+
+import pytest
+
+pytest.importorskip('pyftpdlib')
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import DTPHandler, FTPHandler
+from pyftpdlib.servers import ThreadedFTPServer
+
+import backends
+from backends import FTPBackend
+from uploads import UploadJournal
+
+DROP_AFTER = FTPBackend.resume_margin + 1024 * 1024 #bytes the server takes on one data connection before hanging up
+
+class DroppingDTP(DTPHandler):
+    drops = [] #bytes received on each dropped connection
+
+    def handle_read(self):
+        DTPHandler.handle_read(self)
+        if self.tot_bytes_received > DROP_AFTER:
+            self.drops.append(self.tot_bytes_received)
+            self.close()
+            self.cmd_channel.close()
+    handle_read_event = handle_read
+
+class DroppingHandler(FTPHandler):
+    dtp_handler = DroppingDTP
+
+class NoSizeHandler(DroppingHandler):
+    proto_cmds = dict((cmd, info) for cmd, info in FTPHandler.proto_cmds.items() if cmd != 'SIZE')
+
+@pytest.fixture(params=[DroppingHandler, NoSizeHandler], ids=['size', 'no-size'])
+def server(request, tmpdir, monkeypatch):
+    root = tmpdir.mkdir('ftproot')
+    authorizer = DummyAuthorizer()
+    authorizer.add_user('user', 'secret', str(root), perm='elradfmwMT')
+    monkeypatch.setattr(request.param, 'authorizer', authorizer)
+    monkeypatch.setattr(DroppingDTP, 'drops', [])
+    ftpd = ThreadedFTPServer(('127.0.0.1', 0), request.param)
+    ftpd._exit = threading.Event() #shared by every ThreadedFTPServer otherwise, close_all() would stop the next test's
+    port = ftpd.socket.getsockname()[1]
+    thread = threading.Thread(target=ftpd.serve_forever, kwargs={'timeout': 0.1})
+    thread.daemon = True
+    thread.start()
+    connect = ftplib.FTP.connect
+    monkeypatch.setattr(ftplib.FTP, 'connect', lambda self, host='', port_=0, timeout=-999: connect(self, host, port))
+    monkeypatch.setattr(backends.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(FTPBackend, 'resume_min_size', 0)
+    monkeypatch.setattr(FTPBackend, 'resume_retries', 10)
+    yield root
+    ftpd.close_all()
+
+def ftp_backend(tmpdir):
+    journal = UploadJournal(str(tmpdir.join('journal.json')))
+    settings = {'ftp_host': '127.0.0.1', 'ftp_username': 'user', 'ftp_password': 'secret',
+                'ftp_public_url': 'http://example.com/', 'ftp_remote_dir': ''}
+    return FTPBackend(settings, journal), journal
+
+def test_upload_survives_dropped_connections(server, tmpdir):
+    data = os.urandom(2 * DROP_AFTER + 12345)
+    source = tmpdir.join('big.bin')
+    source.write(data, 'wb')
+    backend, journal = ftp_backend(tmpdir)
+    try:
+        backend.upload_file(str(source), 'big.bin')
+    finally:
+        backend.close()
+    assert server.join('big.bin').read('rb') == data
+    assert DroppingDTP.drops, 'the server never dropped the upload'
+    assert journal.pending() == []
+
+@pytest.mark.parametrize('old, new', [(b'A' * 20000, b'B' * 20000), (b'A' * 20000, b'C' * 50000)],
+                         ids=['same-size', 'longer'])
+def test_fresh_upload_replaces_an_older_remote_file(server, tmpdir, old, new):
+    server.join('paste.bin').write(old, 'wb')
+    source = tmpdir.join('paste.bin')
+    source.write(new, 'wb')
+    backend, journal = ftp_backend(tmpdir)
+    try:
+        backend.upload_file(str(source), 'paste.bin')
+    finally:
+        backend.close()
+    assert server.join('paste.bin').read('rb') == new
+
+def test_stale_journal_offset_is_not_trusted(server, tmpdir):
+    data = os.urandom(DROP_AFTER // 2)
+    source = tmpdir.join('small.bin')
+    source.write(data, 'wb')
+    backend, journal = ftp_backend(tmpdir)
+    journal.begin('small.bin', str(source))
+    journal.commit('small.bin', len(data) - 10, force=True) #from a run that never reached the server
+    try:
+        backend.upload_file(str(source), 'small.bin')
+    finally:
+        backend.close()
+    assert server.join('small.bin').read('rb') == data
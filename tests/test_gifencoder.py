@@ -0,0 +1,116 @@
+import io
+
+import numpy as np
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+from gifencoder import GifEncoder, GifWriter, Palette, color_grid
+from screencast import FrameRing
+
+class KeepOpen(io.BytesIO):
+    def close(self):
+        pass
+
+def record(path, frames, fps=10, **kwargs):
+    height, width = frames[0].shape[:2]
+    ring = FrameRing(len(frames), height, width)
+    encoder = GifEncoder(ring, path, fps, **kwargs)
+    encoder.start()
+    for i, frame in enumerate(frames):
+        ring.claim()[...] = frame
+        ring.commit(i * 1.0 / fps)
+    ring.close()
+    encoder.join()
+    assert encoder.error is None
+    return encoder
+
+def moving_box(count, height=40, width=60):
+    frames = []
+    for i in range(count):
+        frame = np.full((height, width, 3), 200, np.uint8)
+        frame[10:20, i * 4:i * 4 + 10] = (255, 0, 0)
+        frames.append(frame)
+    return frames
+
+@pytest.mark.parametrize('shape', [(1, 1), (3, 5), (120, 160)])
+def test_writer_round_trips_through_pil(shape):
+    indices = (np.arange(shape[0] * shape[1]) * 7 % 251).reshape(shape).astype(np.uint8)
+    colors = np.random.RandomState(0).randint(0, 256, (256, 3)).astype(np.uint8)
+    fp = KeepOpen()
+    writer = GifWriter(fp, shape[1], shape[0], colors)
+    writer.add_frame(indices, 10)
+    writer.close()
+    image = Image.open(io.BytesIO(fp.getvalue()))
+    assert (np.array(image) == indices).all()
+
+def test_encoder_writes_every_frame(tmpdir):
+    path = str(tmpdir.join('moving.gif'))
+    frames = moving_box(10)
+    encoder = record(path, frames)
+    assert encoder.frames == 10
+    image = Image.open(path)
+    assert image.size == (60, 40) and image.n_frames == 10
+    for n in range(10):
+        image.seek(n)
+        decoded = np.array(image.convert('RGB')).astype(int)
+        assert abs(decoded - frames[n]).max() <= 8 #15 bit color lookup
+
+def test_only_the_changed_rectangle_is_written(tmpdir):
+    path = str(tmpdir.join('delta.gif'))
+    record(path, moving_box(4))
+    image = Image.open(path)
+    image.seek(0)
+    assert image.tile[0][1] == (0, 0, 60, 40)
+    for n in range(1, 4):
+        image.seek(n)
+        assert image.tile[0][1] == ((n - 1) * 4, 10, (n - 1) * 4 + 14, 20)
+
+def test_delta_off_writes_whole_frames(tmpdir):
+    path = str(tmpdir.join('full.gif'))
+    record(path, moving_box(3), delta=False)
+    image = Image.open(path)
+    for n in range(3):
+        image.seek(n)
+        assert image.tile[0][1] == (0, 0, 60, 40)
+
+def test_palette_keeps_room_for_unsampled_colors():
+    gray = np.full((20, 30, 3), 128, np.uint8)
+    palette = Palette.from_frames([gray], 255)
+    red = np.zeros((20, 30, 3), np.uint8)
+    red[..., 0] = 250
+    assert tuple(palette.colors[palette.quantize(red)[0, 0]]) == (255, 0, 0)
+    assert len(color_grid(64)) == 64
+
+def test_crop_to_motion(tmpdir):
+    path = str(tmpdir.join('cropped.gif'))
+    frames = []
+    for i in range(6):
+        frame = np.full((50, 80, 3), 30, np.uint8)
+        frame[10:20, 20 + i:30 + i] = (0, 200, 30)
+        frames.append(frame)
+    encoder = record(path, frames, crop_to_motion=True)
+    assert encoder.box == (10, 20, 20, 35)
+    assert Image.open(path).size == (15, 10)
+
+def test_encoder_plays_back_at_recorded_speed(tmpdir):
+    path = str(tmpdir.join('timed.gif'))
+    record(path, moving_box(10))
+    image = Image.open(path)
+    total = 0
+    for n in range(image.n_frames):
+        image.seek(n)
+        total += image.info['duration']
+    assert total == 1000
+
+def test_final_small_change_is_not_merged_away(tmpdir):
+    path = str(tmpdir.join('tail.gif'))
+    frames = [np.full((30, 40, 3), 200, np.uint8) for i in range(5)]
+    frames[2][0:10, 0:10] = 0
+    frames[3][0:10, 0:10] = 0
+    frames[4][0:10, 0:10] = 0
+    frames[4][20, 20] = 0 #a single pixel, well under merge_pixels
+    record(path, frames)
+    image = Image.open(path)
+    image.seek(image.n_frames - 1)
+    assert (np.array(image.convert('RGB'))[20, 20] < 50).all()
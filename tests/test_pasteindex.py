@@ -0,0 +1,58 @@
+from backends import LocalBackend
+from pasteindex import PasteIndex, data_digest, file_digest
+
+def local_backend(tmpdir):
+    return LocalBackend({'local_path': str(tmpdir.join('public')), 'local_public_url': 'http://example.com/'})
+
+def test_digests_agree(tmpdir):
+    path = tmpdir.join('a.txt')
+    path.write('hello world')
+    assert file_digest(str(path)) == data_digest(b'hello ', b'world')
+
+def test_lookup_add_and_persist(tmpdir):
+    backend = local_backend(tmpdir)
+    index = PasteIndex(str(tmpdir.join('index.json')))
+    assert index.lookup('abc', backend) is None
+    index.add('abc', backend, 'x.txt', 'http://example.com/x.txt')
+    assert index.lookup('abc', backend) == 'http://example.com/x.txt'
+    assert index.peek('abc', backend) == ('x.txt', 'http://example.com/x.txt')
+    reloaded = PasteIndex(str(tmpdir.join('index.json')))
+    assert reloaded.peek('abc', backend) == ('x.txt', 'http://example.com/x.txt')
+
+def test_entries_are_per_backend(tmpdir):
+    index = PasteIndex(str(tmpdir.join('index.json')))
+    index.add('abc', local_backend(tmpdir), 'x.txt', 'http://example.com/x.txt')
+    other = LocalBackend({'local_path': str(tmpdir), 'local_public_url': 'http://other.example.com/'})
+    assert index.lookup('abc', other) is None
+
+def test_least_recently_used_is_evicted(tmpdir):
+    backend = local_backend(tmpdir)
+    index = PasteIndex(str(tmpdir.join('index.json')), max_entries=2)
+    index.add('a', backend, 'a', 'url-a')
+    index.add('b', backend, 'b', 'url-b')
+    index._entries[index._key('a', backend)]['used'] += 10 #a was used more recently than b
+    index.add('c', backend, 'c', 'url-c')
+    assert index.peek('a', backend) is not None
+    assert index.peek('b', backend) is None
+    assert index.peek('c', backend) is not None
+
+def test_stale_entry_is_verified_against_the_backend(tmpdir):
+    backend = local_backend(tmpdir)
+    index = PasteIndex(str(tmpdir.join('index.json')), verify_after=0)
+    backend.upload_file(__file__, 'kept.py')
+    index.add('kept', backend, 'kept.py', 'url-kept')
+    index.add('gone', backend, 'gone.py', 'url-gone')
+    assert index.lookup('kept', backend) == 'url-kept'
+    assert index.lookup('gone', backend) is None
+    assert index.peek('gone', backend) is None
+
+def test_overwriting_a_name_forgets_its_old_content(tmpdir):
+    backend = local_backend(tmpdir)
+    other = LocalBackend({'local_path': str(tmpdir), 'local_public_url': 'http://other.example.com/'})
+    index = PasteIndex(str(tmpdir.join('index.json')))
+    index.add('v1', backend, 'report.txt', 'http://example.com/report.txt')
+    index.add('v1', other, 'report.txt', 'http://other.example.com/report.txt')
+    index.add('v2', backend, 'report.txt', 'http://example.com/report.txt')
+    assert index.lookup('v1', backend) is None
+    assert index.lookup('v2', backend) == 'http://example.com/report.txt'
+    assert index.lookup('v1', other) == 'http://other.example.com/report.txt'
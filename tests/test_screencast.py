@@ -0,0 +1,119 @@
+import io
+import os
+import stat
+import tempfile
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import screencast
+from screencast import Grabber, GrabberShotter, ScaledGrabber, ScreencaptureShotter, ScreencastSession, downscale
+
+class FakeGrabber(Grabber):
+    #frames of a fixed gradient, so tests can run without a screen
+    def __init__(self, width=64, height=48):
+        self.width = width
+        self.height = height
+        self.closed = False
+
+    def size(self):
+        return (self.width, self.height)
+
+    def grab(self, out):
+        out[...] = (np.arange(self.height * self.width * 3) % 251).reshape(self.height, self.width, 3)
+
+    def close(self):
+        self.closed = True
+
+def test_downscale_averages_blocks():
+    frame = np.zeros((5, 7, 3), np.uint8)
+    frame[0:2, 0:2] = [[[10, 0, 0]], [[20, 0, 255]]]
+    small = downscale(frame, 2)
+    assert small.shape == (2, 3, 3) #edge pixels that don't fill a block are dropped
+    assert small[0, 0].tolist() == [15, 0, 128]
+    assert (small[1:, :] == 0).all() and (small[:, 1:] == 0).all()
+
+def test_scaled_grabber_matches_downscale():
+    grabber = FakeGrabber()
+    scaled = ScaledGrabber(grabber, 4)
+    assert scaled.size() == (16, 12)
+    out = np.empty((12, 16, 3), np.uint8)
+    scaled.grab(out)
+    full = np.empty((48, 64, 3), np.uint8)
+    grabber.grab(full)
+    assert (out == downscale(full, 4)).all()
+    scaled.close()
+    assert grabber.closed
+
+def test_grabber_shotter_png_decodes():
+    grabber = FakeGrabber()
+    shotter = GrabberShotter(grabber, compression=1)
+    image = Image.open(io.BytesIO(shotter.shoot()))
+    assert (image.format, image.size, image.mode) == ('PNG', (64, 48), 'RGB')
+    frame = np.empty((48, 64, 3), np.uint8)
+    grabber.grab(frame)
+    assert (np.asarray(image) == frame).all()
+    shotter.close()
+    assert grabber.closed
+
+@pytest.fixture
+def shot_dir(tmpdir, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmpdir.mkdir('shots')))
+    return tmpdir.join('shots')
+
+def test_screencapture_shotter_reads_the_file_back(tmpdir, shot_dir):
+    png = tmpdir.join('shot.png')
+    Image.new('RGB', (8, 4), (255, 0, 0)).save(str(png))
+    #the stub gets the output path appended, like screencapture -i -t png <path>
+    data = ScreencaptureShotter(['cp', str(png)]).shoot()
+    assert data == png.read('rb')
+    assert shot_dir.listdir() == []
+
+def test_screencapture_shotter_cancelled(shot_dir):
+    #Escape in screencapture -i exits without writing anything
+    assert ScreencaptureShotter(['true']).shoot() is None
+    assert shot_dir.listdir() == []
+
+@pytest.fixture
+def fake_screen(monkeypatch):
+    monkeypatch.setattr(screencast, 'default_grabber', lambda region=None: FakeGrabber())
+
+def session(**kwargs):
+    states = []
+    recording = ScreencastSession('cast', lambda session, state: states.append(state), fps=20, start_delay=0, **kwargs)
+    return recording, states
+
+def test_stop_during_start_delay_cancels(fake_screen):
+    recording, states = session(max_seconds=5)
+    recording.start_delay = 5
+    recording.start()
+    recording.stop()
+    recording.join(2)
+    assert not recording.is_alive()
+    assert states == [screencast.CANCELLED] and recording.engine is None
+    assert not os.path.exists(recording.directory)
+
+def test_gif_session_given_up_at_uploading_cleans_up(fake_screen):
+    recording, states = session(max_seconds=0.5)
+    recording.start()
+    recording.join(10)
+    assert states == [screencast.RECORDING, screencast.ENCODING, screencast.UPLOADING]
+    assert os.path.getsize(recording.path) > 0
+    recording.finished('upload queue full')
+    assert states[-1] == screencast.FAILED
+    assert not os.path.exists(recording.directory)
+
+def test_video_session_nobody_reads_does_not_hang(fake_screen, tmpdir):
+    ffmpeg = tmpdir.join('ffmpeg')
+    ffmpeg.write('#!/bin/sh\nexec cat\n') #stands in for ffmpeg, its stdout fills up once nobody reads it
+    ffmpeg.chmod(stat.S_IRWXU)
+    recording, states = session(max_seconds=10, format='webm', ffmpeg=str(ffmpeg))
+    recording.start()
+    while recording.state is None:
+        recording.join(0.01)
+    recording.finished('upload queue full')
+    recording.join(5)
+    assert not recording.is_alive()
+    assert recording.encoder.proc.poll() is not None
+    assert states[-1] == screencast.FAILED
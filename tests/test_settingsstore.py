@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from settingsstore import SettingsStore
+
+DEFAULTS = {'name': 'clipbox', 'retries': 3, 'ratio': 0.5, 'enabled': False, 'mode': 'a'}
+
+def check_name(value):
+    if value.startswith('_'):
+        raise ValueError('must not start with _')
+
+@pytest.fixture
+def store(tmpdir):
+    return SettingsStore(str(tmpdir.join('config.txt')), DEFAULTS, choices={'mode': ('a', 'b')},
+                         ranges={'retries': (0, 10)}, validators={'name': check_name})
+
+def test_file_is_read_only_when_it_changes(store, tmpdir):
+    assert store.settings == DEFAULTS
+    tmpdir.join('config.txt').write(json.dumps({'name': 'mine'}))
+    assert store.reload()
+    assert store.settings['name'] == 'mine'
+    assert not store.reload()
+
+def test_snapshot_is_read_only(store):
+    with pytest.raises(TypeError):
+        store.settings['name'] = 'x'
+
+def test_subscribers_hear_about_their_keys_only(store):
+    heard = []
+    store.subscribe(lambda settings: heard.append(('any', settings.version)))
+    store.subscribe(lambda settings: heard.append(('mode', settings['mode'])), ['mode'])
+    store.write(json.dumps({'retries': 1}))
+    store.write(json.dumps({'mode': 'b'}))
+    store.write(json.dumps({'mode': 'b'}))
+    assert heard == [('any', 1), ('any', 2), ('mode', 'b'), ('any', 3)]
+
+def test_script_etag_follows_the_file(store):
+    script, etag = store.script()
+    store.write(json.dumps({'name': 'other'}))
+    new_script, new_etag = store.script()
+    assert new_etag != etag and b'other' in new_script
+
+def test_values_are_coerced_to_the_default_type(store):
+    values, errors = store.validate({'retries': '4', 'ratio': 1, 'enabled': 'yes', 'name': 7})
+    assert errors == []
+    assert values == {'retries': 4, 'ratio': 1, 'enabled': True, 'name': u'7'}
+
+@pytest.mark.parametrize('key, value', [
+    ('retries', 'many'), ('retries', True), ('retries', 11), ('retries', float('nan')),
+    ('enabled', 'maybe'), ('name', False), ('mode', 'c'), ('name', [1]), ('name', '_hidden'), ('nmae', 'typo'),
+])
+def test_bad_values_are_rejected(store, key, value):
+    values, errors = store.validate({key: value})
+    assert key not in values
+    assert len(errors) == 1 and errors[0].startswith(key)
+
+def test_write_merges_into_the_file(store, tmpdir):
+    tmpdir.join('config.txt').write(json.dumps({'name': 'mine', 'retries': 5}))
+    store.reload()
+    assert store.write(json.dumps({'enabled': True})) == []
+    assert json.loads(tmpdir.join('config.txt').read()) == {'name': 'mine', 'retries': 5, 'enabled': True}
+    assert store.settings['name'] == 'mine' and store.settings['enabled'] is True
+
+def test_write_rejects_invalid_input_and_keeps_the_file(store, tmpdir):
+    store.write(json.dumps({'retries': 2}))
+    assert store.write('{not json') != []
+    assert store.write(json.dumps({'retries': True})) == ['retries must be a number']
+    assert json.loads(tmpdir.join('config.txt').read()) == {'retries': 2}
@@ -0,0 +1,100 @@
+import gzip
+import io
+import os
+import time
+from wsgiref.util import setup_testing_defaults
+
+import bottle
+
+STATIC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static')
+ASSETS = ['ico/favicon.ico', 'css/bootstrap.min.css', 'css/bootstrap-theme.min.css',
+          'css/theme.css', 'js/bootstrap.min.js']
+
+def make_app(root, **kwargs):
+    app = bottle.Bottle()
+    app.route('/static/:filename#.*#', callback=bottle.StaticFiles(root, **kwargs))
+    app.route('/plain/:filename#.*#', callback=lambda filename: bottle.static_file(filename, root))
+    return app
+
+def get(app, path, **headers):
+    ''' Calls the WSGI app in-process, returns (status, headers, body) with lowercased header names. '''
+    environ = {'PATH_INFO': path}
+    environ.update(('HTTP_' + name.upper(), value) for name, value in headers.items())
+    setup_testing_defaults(environ)
+    started = []
+    def start_response(status, response_headers, exc_info=None):
+        started.append((int(status.split()[0]), dict((k.lower(), v) for k, v in response_headers)))
+    body = b''.join(app(environ, start_response))
+    return started[0][0], started[0][1], body
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+
+def test_page_load_bytes():
+    app = make_app(STATIC)
+    identity = gzipped = 0
+    for name in ASSETS:
+        status, headers, body = get(app, '/static/' + name)
+        with open(os.path.join(STATIC, name), 'rb') as fp:
+            assert body == fp.read()
+        identity += len(body)
+        status, headers, packed = get(app, '/static/' + name, accept_encoding='gzip, deflate')
+        assert status == 200
+        if headers.get('content-encoding') == 'gzip':
+            assert gunzip(packed) == body
+            assert headers['vary'] == 'Accept-Encoding'
+        gzipped += len(packed)
+    #147886 -> 28073 bytes for the whole page
+    assert gzipped < identity / 4, '%d -> %d bytes' % (identity, gzipped)
+
+def test_revalidation_is_a_304_without_body():
+    app = make_app(STATIC)
+    for name in ASSETS:
+        for coding in ('', 'gzip'):
+            status, headers, body = get(app, '/static/' + name, accept_encoding=coding)
+            status, again, body = get(app, '/static/' + name, accept_encoding=coding,
+                                      if_none_match=headers['etag'])
+            assert (status, body) == (304, b'')
+            assert again['etag'] == headers['etag']
+    plain = get(app, '/static/css/theme.css')[1]['etag']
+    packed = get(app, '/static/css/theme.css', accept_encoding='gzip')[1]['etag']
+    assert plain != packed
+
+def test_cached_assets_are_faster_than_static_file():
+    app = make_app(STATIC)
+    def per_asset(prefix):
+        best = None
+        for attempt in range(5):
+            started = time.time()
+            for i in range(20):
+                for name in ASSETS:
+                    get(app, prefix + name, accept_encoding='gzip')
+            elapsed = (time.time() - started) / (20 * len(ASSETS))
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+    get(app, '/static/css/theme.css')
+    cached, uncached = per_asset('/static/'), per_asset('/plain/')
+    #about 47us vs 96us
+    assert cached < uncached, '%.0fus vs %.0fus per asset' % (cached * 1e6, uncached * 1e6)
+
+def test_edits_are_noticed(tmpdir):
+    tmpdir.join('app.js').write('one')
+    app = make_app(str(tmpdir), check_interval=0)
+    assert get(app, '/static/app.js')[2] == b'one'
+    tmpdir.join('app.js').write('two, longer')
+    assert get(app, '/static/app.js')[2] == b'two, longer'
+
+def test_range_and_big_files_fall_back_to_static_file(tmpdir):
+    tmpdir.join('big.txt').write('x' * 100)
+    app = make_app(str(tmpdir), max_size=10)
+    status, headers, body = get(app, '/static/big.txt', accept_encoding='gzip')
+    assert (status, body) == (200, b'x' * 100)
+    assert 'content-encoding' not in headers
+    status, headers, body = get(app, '/static/big.txt', range='bytes=0-9')
+    assert (status, body) == (206, b'x' * 10)
+
+def test_outside_root_is_refused(tmpdir):
+    tmpdir.mkdir('root')
+    tmpdir.join('secret.txt').write('no')
+    app = make_app(str(tmpdir.join('root')))
+    assert get(app, '/static/../secret.txt')[0] in (403, 404)
@@ -0,0 +1,95 @@
+import httplib
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+import bottle
+
+STATIC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static')
+ASSETS = ['/static/ico/favicon.ico', '/static/css/bootstrap.min.css',
+          '/static/css/bootstrap-theme.min.css', '/static/css/theme.css', '/static/js/bootstrap.min.js']
+WORKERS = 4
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+@pytest.fixture(scope='module')
+def port():
+    #the settings page's app, minus clipbox: /static served through StaticFiles
+    app = bottle.Bottle()
+    assets = bottle.StaticFiles(STATIC)
+    app.route('/static/:filename#.*#', callback=assets)
+    server = bottle.ThreadPoolServer(host='127.0.0.1', port=free_port(), workers=WORKERS, keepalive=2)
+    server.quiet = True
+    thread = threading.Thread(target=server.run, args=(app,))
+    thread.daemon = True #serve_forever has no way out, it goes with the test process
+    thread.start()
+    deadline = time.time() + 5
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', server.port), timeout=1).close()
+            return server.port
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.01)
+
+def load_page(port, rounds, timings=None):
+    ''' Fetches the settings page's assets `rounds` times over one connection. '''
+    conn = httplib.HTTPConnection('127.0.0.1', port, timeout=5)
+    sizes = []
+    for i in range(rounds):
+        for path in ASSETS:
+            started = time.time()
+            conn.request('GET', path)
+            response = conn.getresponse()
+            body = response.read()
+            if timings is not None:
+                timings.append(time.time() - started)
+            assert response.status == 200
+            sizes.append(len(body))
+    conn.close()
+    return sizes
+
+def test_keep_alive_requests_are_not_held_back(port):
+    #wsgiref writes headers and body separately, Nagle and delayed ACKs used to add ~40ms to each reused request
+    timings = []
+    load_page(port, 10, timings)
+    timings.sort()
+    assert timings[len(timings) // 2] < 0.02, 'median %.1fms per asset' % (timings[len(timings) // 2] * 1000)
+
+def test_concurrent_clients(port):
+    results, errors = [], []
+    def client():
+        try:
+            results.append(load_page(port, 5))
+        except Exception as e:
+            errors.append(e)
+    clients = [threading.Thread(target=client) for i in range(WORKERS * 2)]
+    started = time.time()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join(30)
+    elapsed = time.time() - started
+    assert not errors
+    assert len(results) == len(clients)
+    assert all(sizes == results[0] for sizes in results)
+    assert elapsed < 10, '%d clients took %.1fs' % (len(clients), elapsed)
+
+def test_stalled_client_does_not_block_others(port):
+    stalled = socket.create_connection(('127.0.0.1', port))
+    stalled.sendall(b'GET /static/css/theme.css HTTP/1.1\r\nHost: x') #and then nothing
+    try:
+        started = time.time()
+        load_page(port, 1)
+        assert time.time() - started < 1
+    finally:
+        stalled.close()
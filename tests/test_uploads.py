@@ -0,0 +1,107 @@
+import io
+import threading
+import time
+
+from backends import LocalBackend
+from uploads import Paste, UploadJournal, UploadQueue, file_index_page, upload_files
+
+def local_backend(tmpdir):
+    return LocalBackend({'local_path': str(tmpdir.join('public')), 'local_public_url': 'http://example.com/'})
+
+def test_queue_runs_handler_and_reports(tmpdir):
+    backend = local_backend(tmpdir)
+    done = []
+    finished = threading.Event()
+    def handler(paste):
+        backend.upload(io.BytesIO(paste.data), paste.name)
+        return backend.public_url(paste.name)
+    def on_done(paste, url):
+        done.append(url)
+        finished.set()
+    queue = UploadQueue(handler, on_done, None)
+    assert queue.put(Paste('text', 'note.txt', b'hello'))
+    queue.join()
+    assert finished.wait(5)
+    assert done == ['http://example.com/note.txt']
+    assert tmpdir.join('public', 'note.txt').read() == 'hello'
+
+def test_queue_reports_errors(tmpdir):
+    errors = []
+    def handler(paste):
+        raise IOError('disk full')
+    queue = UploadQueue(handler, None, lambda paste, e: errors.append((paste.name, str(e))))
+    queue.put(Paste('text', 'a', b''))
+    queue.join()
+    assert errors == [('a', 'disk full')]
+
+def test_full_queue_refuses_instead_of_blocking():
+    release = threading.Event()
+    queue = UploadQueue(lambda paste: release.wait(5), lambda paste, url: None, None, workers=1, maxsize=1)
+    queue.put(Paste('text', 'busy', b''))
+    accepted = [queue.put(Paste('text', str(i), b'')) for i in range(3)]
+    release.set()
+    assert False in accepted
+
+def test_queue_beats_the_serial_path():
+    #what the hotkey handler used to do: one upload after the other, on the caller's thread
+    delay = 0.05
+    pastes = [Paste('text', str(i), b'') for i in range(12)]
+    def handler(paste):
+        time.sleep(delay)
+        return paste.name
+    started = time.time()
+    for paste in pastes:
+        handler(paste)
+    serial = time.time() - started
+
+    done = []
+    queue = UploadQueue(handler, lambda paste, url: done.append(url), None, workers=4)
+    started = time.time()
+    assert all(queue.put(paste) for paste in pastes)
+    enqueued = time.time() - started
+    queue.join()
+    queued = time.time() - started
+    assert sorted(done, key=int) == [paste.name for paste in pastes]
+    assert enqueued < delay #the caller never waits for an upload
+    assert queued < serial / 2
+
+def test_upload_files_in_parallel(tmpdir):
+    backend = local_backend(tmpdir)
+    paths = []
+    for i in range(5):
+        path = tmpdir.join('src%d.txt' % i)
+        path.write('file %d' % i)
+        paths.append(str(path))
+    names = ['up%d.txt' % i for i in range(5)]
+    upload_files(backend, paths, names)
+    for i, name in enumerate(names):
+        assert tmpdir.join('public', name).read() == 'file %d' % i
+
+def test_index_page_escapes_names():
+    page = file_index_page(['a<b>.txt'], ['http://example.com/a"b'])
+    assert 'a&lt;b&gt;.txt' in page and 'a&quot;b' in page
+
+def test_journal_survives_a_restart(tmpdir):
+    source = tmpdir.join('big.bin')
+    source.write('x' * 100)
+    journal = UploadJournal(str(tmpdir.join('journal.json')), save_interval=0)
+    journal.begin('big.bin', str(source))
+    journal.commit('big.bin', 40)
+    reloaded = UploadJournal(str(tmpdir.join('journal.json')))
+    assert reloaded.pending() == [('big.bin', str(source))]
+    assert reloaded.offset('big.bin') == 40
+    reloaded.finish('big.bin')
+    assert UploadJournal(str(tmpdir.join('journal.json'))).pending() == []
+
+def test_journal_forgets_changed_files(tmpdir):
+    source = tmpdir.join('big.bin')
+    source.write('x' * 100)
+    journal = UploadJournal(str(tmpdir.join('journal.json')))
+    journal.begin('big.bin', str(source))
+    source.write('y' * 50)
+    gone = tmpdir.join('gone.bin')
+    gone.write('z' * 10)
+    journal.begin('gone.bin', str(gone))
+    gone.remove()
+    assert journal.pending() == []
+    assert UploadJournal(str(tmpdir.join('journal.json')))._entries == {} #dropped from the file too
@@ -0,0 +1,151 @@
+#Background upload worker, so hotkey handlers only have to grab the clipboard and move on.
+import cgi
+import json
+import os
+import threading
+import time
+import Queue
+from multiprocessing.pool import ThreadPool
+
+import metrics
+
+class Paste(object):
+    def __init__(self, kind, name, data):
+        self.kind = kind #'text', 'file', 'bitmap', 'png' or 'stream'
+        self.name = name #pasteID, the remote file name
+        self.data = data #the text, the list of file paths, the wx.Image of a bitmap, PNG bytes, or a file-like stream
+        self.url = None #public URL, set as soon as it is on the clipboard
+        self.attempts = 0 #failed uploads so far
+        self.session = None #the screencast.ScreencastSession a screencast came from
+        self.digest = None #content hash for dedup, worked out before the URL is published
+        self.timer = metrics.PasteTimer(name, kind)
+
+class UploadQueue(object):
+    #Bounded queue of pastes drained by worker threads. handler(paste) does the upload and
+    #returns the public URL; on_done(paste, url) / on_error(paste, exc) run on the worker thread,
+    #so callers that touch the UI should wrap them in wx.CallAfter.
+    def __init__(self, handler, on_done, on_error, workers=2, maxsize=16):
+        self.handler = handler
+        self.on_done = on_done
+        self.on_error = on_error
+        self._jobs = Queue.Queue(maxsize)
+        for i in range(workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+
+    def put(self, paste):
+        #never blocks the caller, returns False if the queue is full
+        try:
+            self._jobs.put_nowait(paste)
+            return True
+        except Queue.Full:
+            return False
+
+    def join(self):
+        self._jobs.join()
+
+    def _work(self):
+        while True:
+            paste = self._jobs.get()
+            try:
+                url = self.handler(paste)
+            except Exception as e:
+                self.on_error(paste, e)
+            else:
+                self.on_done(paste, url)
+            finally:
+                self._jobs.task_done()
+
+class UploadJournal(object):
+    #Resumable uploads in flight: remote name -> local path, size, mtime and the last byte offset
+    #known to have been sent. Survives restarts so unfinished uploads can be picked up again.
+    def __init__(self, path, save_interval=1.0):
+        self.path = path
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._last_save = 0
+        self._entries = {}
+        try:
+            spdatafile = open(path, 'r')
+            self._entries = json.loads(spdatafile.read())
+            spdatafile.close()
+        except (IOError, ValueError):
+            pass
+
+    def begin(self, name, path):
+        st = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or (entry['path'], entry['size'], entry['mtime']) != (path, st.st_size, st.st_mtime):
+                self._entries[name] = {'path': path, 'size': st.st_size, 'mtime': st.st_mtime, 'offset': 0}
+            self._save()
+
+    def offset(self, name):
+        with self._lock:
+            return self._entries[name]['offset']
+
+    def commit(self, name, offset, force=False):
+        with self._lock:
+            self._entries[name]['offset'] = offset
+            if force or time.time() - self._last_save >= self.save_interval:
+                self._save()
+
+    def finish(self, name):
+        with self._lock:
+            self._entries.pop(name, None)
+            self._save()
+
+    def pending(self):
+        #(name, path) of unfinished uploads whose local file hasn't changed since; entries for
+        #files that are gone or changed can never be finished, so they are dropped
+        with self._lock:
+            entries = self._entries.items()
+        unfinished = []
+        stale = []
+        for name, entry in entries:
+            try:
+                st = os.stat(entry['path'])
+            except OSError:
+                stale.append((name, entry))
+                continue
+            if (st.st_size, st.st_mtime) == (entry['size'], entry['mtime']):
+                unfinished.append((name, entry['path']))
+            else:
+                stale.append((name, entry))
+        if stale:
+            with self._lock:
+                for name, entry in stale:
+                    if self._entries.get(name) is entry: #not begun again meanwhile
+                        del self._entries[name]
+                self._save()
+        return unfinished
+
+    def _save(self):
+        self._last_save = time.time()
+        tmppath = self.path + '.tmp'
+        spdatafile = open(tmppath, 'w')
+        spdatafile.write(json.dumps(self._entries))
+        spdatafile.close()
+        os.rename(tmppath, self.path)
+
+def upload_files(backend, paths, names):
+    #upload several files at once, as many in parallel as the backend allows
+    if len(paths) == 1 or not backend.parallel:
+        for path, name in zip(paths, names):
+            backend.upload_file(path, name)
+        return
+    timer = metrics.current()
+    def upload(job):
+        metrics.use(timer) #pool threads report into the same paste
+        backend.upload_file(*job)
+    pool = ThreadPool(min(len(paths), backend.max_parallel))
+    try:
+        pool.map(upload, zip(paths, names))
+    finally:
+        pool.close()
+
+def file_index_page(names, urls):
+    #small HTML listing for a multi-file paste
+    rows = ''.join('<li><a href="%s">%s</a></li>\n' % (cgi.escape(url, True), cgi.escape(name)) for name, url in zip(names, urls))
+    return '<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>Clipbox</title></head>\n<body><ul>\n%s</ul></body></html>\n' % rows
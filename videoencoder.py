@@ -0,0 +1,63 @@
+#WebM/MP4 screencasts: raw frames are piped into an ffmpeg subprocess as they are captured, and the
+#encoded video comes out of its stdout, ready to be streamed to the backend while it is being written.
+import subprocess
+import tempfile
+import threading
+
+import numpy as np
+
+formats = {
+    'webm': ['-c:v', 'libvpx', '-b:v', '1M', '-deadline', 'realtime', '-cpu-used', '8', '-f', 'webm'],
+    #fragmented so the muxer never has to seek back into a pipe
+    'mp4': ['-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2',
+            '-movflags', 'frag_keyframe+empty_moov', '-f', 'mp4'],
+}
+
+class FfmpegEncoder(threading.Thread):
+    #Same place in the pipeline as gifencoder.GifEncoder: takes frames off a screencast FrameRing
+    #and feeds them to ffmpeg. Read the finished video from self.stream.
+    def __init__(self, ring, fps, format='webm', ffmpeg='ffmpeg'):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.ring = ring
+        self.frames = 0
+        self.error = None
+        self._cancelled = False
+        self._log = tempfile.TemporaryFile()
+        cmd = [ffmpeg, '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%dx%d' % (ring.width, ring.height),
+               '-r', str(fps), '-i', '-'] + formats[format] + ['-']
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self._log)
+        self.stream = self.proc.stdout
+
+    def run(self):
+        try:
+            while True:
+                item = self.ring.take()
+                if item is None or self._cancelled:
+                    break
+                frame, timestamp = item
+                data = np.ascontiguousarray(frame).tostring()
+                self.ring.release()
+                self.proc.stdin.write(data)
+                self.frames += 1
+        except Exception as e:
+            if not self._cancelled:
+                self.error = e
+        finally:
+            try:
+                self.proc.stdin.close()
+            except IOError:
+                pass #ffmpeg is gone already
+            #ffmpeg exiting early shows up here as a broken pipe, what it printed says more
+            if self.proc.wait() != 0 and not self._cancelled:
+                self._log.seek(0)
+                self.error = 'ffmpeg failed: ' + self._log.read().strip()
+            self._log.close()
+
+    def cancel(self):
+        #kill ffmpeg, whoever reads self.stream gets a truncated video
+        self._cancelled = True
+        try:
+            self.proc.kill()
+        except OSError:
+            pass #already exited